@@ -1,2 +1,2 @@
 from domain import Domain, Mesh
-from anim import insert_anim
+from anim import insert_anim, Animation
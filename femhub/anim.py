@@ -1,3 +1,26 @@
+"""
+Animations of meshes and fields.
+
+Frames are recorded with Animation.add() as references to the nodes and
+elements of the meshes (shared by all the frames of the same mesh), so
+recording is cheap and the meshes are converted to arrays only when the
+animation is rendered. The frames are rendered in a pool of processes, each
+frame drawn as one PolyCollection, and encoded as an HTML5 strip (PNG
+frames with a small javascript player) or as an animated GIF.
+"""
+
+import base64
+from cStringIO import StringIO
+from multiprocessing import Pool, cpu_count
+
+from numpy import (asarray, column_stack, repeat, full, nan, nanmin, nanmax,
+        nanmean)
+
+# the frames shared with the worker processes (see _init_worker())
+_meshes = None
+_frames = None
+_options = None
+
 def insert_anim():
     htm = """<html><object width="890" height="435">
     <param name="movie"
@@ -8,3 +31,244 @@ def insert_anim():
     src="../../pub/1/cells/2/SlideShow.swf" allowscriptaccess="always"
     allowfullscreen="true"></embed>
     </object></html>"""
+    return htm
+
+def _polygons(nodes, elements):
+    """
+    Returns the (n, 4, 2) array of the element corners, the padded triangles
+    repeat their first node.
+    """
+    from storage import iter_blocks
+    pts = asarray(nodes, dtype=float).reshape(-1, 2)
+    blocks = list(iter_blocks(elements, max(len(elements), 1), dtype=int))
+    if not blocks:
+        return full((0, 4, 2), nan)
+    e = blocks[0]
+    if e.shape[1] == 3:
+        e = column_stack([e, e[:, 0]])
+    else:
+        e = e.copy()
+    padded = e == -1
+    e[padded] = repeat(e[:, :1], 4, axis=1)[padded]
+    return pts[e]
+
+def _element_values(elements, values):
+    """
+    Returns the values per element, the nodal values are averaged.
+    """
+    from storage import iter_blocks
+    values = asarray(values, dtype=float)
+    if len(values) == len(elements):
+        return values
+    e = list(iter_blocks(elements, max(len(elements), 1), dtype=int))[0]
+    v = values[e.clip(min=0)]
+    v[e == -1] = nan
+    return nanmean(v, axis=1)
+
+def _init_worker(meshes, frames, options):
+    global _meshes, _frames, _options
+    _meshes = meshes
+    _frames = frames
+    _options = options
+
+def _render_frame(k):
+    """
+    Renders the k-th frame into a PNG (returned as a string).
+    """
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.collections import PolyCollection
+    key, values, title = _frames[k]
+    nodes, elements = _meshes[key][:2]
+    if len(_meshes[key]) == 2:
+        # the polygons are computed once per mesh in every worker
+        _meshes[key] = (nodes, elements, _polygons(nodes, elements))
+    polygons = _meshes[key][2]
+    o = _options
+    fig = Figure(figsize=o["figsize"])
+    FigureCanvasAgg(fig)
+    ax = fig.add_subplot(111)
+    if values is None:
+        c = PolyCollection(polygons, facecolors="none", edgecolors="g",
+                linewidths=0.5)
+    else:
+        c = PolyCollection(polygons, cmap=o["cmap"], edgecolors="face",
+                linewidths=0.2)
+        c.set_array(_element_values(elements, values))
+        c.set_clim(o["vmin"], o["vmax"])
+    ax.add_collection(c)
+    ax.set_xlim(o["xlim"])
+    ax.set_ylim(o["ylim"])
+    ax.set_aspect("equal")
+    if title is not None:
+        ax.set_title(title)
+    f = StringIO()
+    fig.savefig(f, format="png", dpi=o["dpi"])
+    return f.getvalue()
+
+class Animation:
+    """
+    Sequence of mesh snapshots rendered into an animation.
+
+    Every frame is a mesh, optionally with the values (per node or per
+    element) shown in color. The nodes, elements and value arrays are not
+    copied, so a mesh or a field that is updated in place must be passed as
+    a copy.
+
+    Example:
+
+    >>> m = Mesh([[0, 0], [1, 0], [0, 1]], [[0, 1, 2]], [[0, 1, 1], [1, 2, 1], [2, 0, 1]])
+    >>> a = Animation()
+    >>> for l in m.hierarchy(4).meshes:
+            a.add(l, title="%d elements" % len(l.elements))
+    >>> len(a)
+    4
+    >>> html = a.to_html()
+
+    """
+
+    def __init__(self, figsize=(6, 4.5), dpi=80, cmap="jet", interval=200):
+        self.figsize = figsize
+        self.dpi = dpi
+        self.cmap = cmap
+        self.interval = interval
+        self._meshes = {}
+        self._frames = []
+        self._images = None
+
+    def __len__(self):
+        return len(self._frames)
+
+    def add(self, mesh, values=None, title=None):
+        """
+        Records the mesh (and the values on it) as the next frame.
+        """
+        key = id(mesh)
+        if key not in self._meshes:
+            # the mesh is kept too, so that its id is not reused
+            self._meshes[key] = (mesh.nodes, mesh.elements, mesh)
+        if values is not None:
+            values = asarray(values, dtype=float)
+            if len(values) not in (len(mesh.nodes), len(mesh.elements)):
+                raise ValueError("One value per node or element is expected.")
+        self._frames.append((key, values, title))
+        self._images = None
+
+    def _options(self):
+        lo = []
+        hi = []
+        for nodes, elements, mesh in self._meshes.values():
+            if len(nodes):
+                nodes = asarray(nodes, dtype=float).reshape(-1, 2)
+                lo.append(nodes.min(axis=0))
+                hi.append(nodes.max(axis=0))
+        lo = asarray(lo).min(axis=0)
+        hi = asarray(hi).max(axis=0)
+        margin = 0.02*(hi - lo).max()
+        fields = [v for key, v, title in self._frames if v is not None]
+        vmin = min([nanmin(v) for v in fields]) if fields else 0
+        vmax = max([nanmax(v) for v in fields]) if fields else 1
+        return {"figsize": self.figsize, "dpi": self.dpi, "cmap": self.cmap,
+                "xlim": (lo[0] - margin, hi[0] + margin),
+                "ylim": (lo[1] - margin, hi[1] + margin),
+                "vmin": vmin, "vmax": vmax}
+
+    def render(self, processes=None):
+        """
+        Renders all the frames and returns the list of the PNG images.
+
+        The frames are rendered in parallel by "processes" processes (by
+        default one per CPU). The images are cached until the next frame is
+        added.
+        """
+        if self._images is not None:
+            return self._images
+        if not self._frames:
+            raise ValueError("The animation has no frames.")
+        meshes = dict([(key, m[:2]) for key, m in self._meshes.items()])
+        args = (meshes, self._frames, self._options())
+        if processes is None:
+            processes = cpu_count()
+        processes = min(processes, len(self._frames))
+        if processes <= 1:
+            _init_worker(*args)
+            try:
+                images = [_render_frame(k) for k in range(len(self._frames))]
+            finally:
+                _init_worker(None, None, None)
+        else:
+            pool = Pool(processes, _init_worker, args)
+            try:
+                chunk = max(1, len(self._frames) // (4*processes))
+                images = pool.map(_render_frame, range(len(self._frames)),
+                        chunk)
+            finally:
+                pool.terminate()
+        self._images = images
+        return images
+
+    def to_html(self, processes=None):
+        """
+        Returns the HTML5 animation: the frames as PNG images embedded in
+        the page with a javascript player (play/pause and a slider).
+        """
+        images = self.render(processes)
+        name = "femhub_anim_%d" % id(self)
+        frames = ",\n".join(['"data:image/png;base64,%s"' %
+            base64.b64encode(img) for img in images])
+        return """\
+<html><div id="%(name)s"><img id="%(name)s_img" src="data:image/png;base64,%(first)s"/><br/>
+<button onclick="%(name)s.toggle();">Play/Pause</button>
+<input type="range" id="%(name)s_slider" min="0" max="%(last)d" value="0"
+oninput="%(name)s.show(parseInt(this.value));"/></div>
+<script type="text/javascript">
+var %(name)s = {
+    frames: [%(frames)s],
+    current: 0,
+    timer: null,
+    show: function(k) {
+        this.current = k;
+        document.getElementById("%(name)s_img").src = this.frames[k];
+        document.getElementById("%(name)s_slider").value = k;
+    },
+    toggle: function() {
+        var self = this;
+        if (this.timer) {
+            clearInterval(this.timer);
+            this.timer = null;
+            return;
+        }
+        this.timer = setInterval(function() {
+            self.show((self.current + 1) %% self.frames.length);
+        }, %(interval)d);
+    }
+};
+</script></html>""" % {"name": name, "first": base64.b64encode(images[0]),
+                "last": len(images) - 1, "frames": frames,
+                "interval": self.interval}
+
+    def save_html(self, filename, processes=None):
+        """
+        Saves the HTML5 animation into the file.
+        """
+        f = open(filename, "w")
+        try:
+            f.write(self.to_html(processes))
+        finally:
+            f.close()
+
+    def save_gif(self, filename, processes=None):
+        """
+        Saves the animation as an animated GIF (PIL must be installed).
+        """
+        from PIL import Image
+        images = [Image.open(StringIO(img)).convert("RGB").convert("P",
+            palette=Image.ADAPTIVE) for img in self.render(processes)]
+        images[0].save(filename, save_all=True, append_images=images[1:],
+                duration=self.interval, loop=0)
+
+    def show(self, processes=None):
+        """
+        Displays the animation in the notebook.
+        """
+        print self.to_html(processes)
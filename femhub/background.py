@@ -0,0 +1,224 @@
+"""
+Triangulation running in a subprocess.
+
+The advancing front triangulation is pure Python and can take long for large
+domains. Running it in a separate process keeps the notebook responsive and
+allows to kill a runaway triangulation cleanly. A background thread in the
+parent process collects the progress events and the result.
+"""
+
+import time
+import threading
+from multiprocessing import Process, Pipe
+
+from triangulation import TriangulationError, triangulate_regions
+
+# minimal delay (in seconds) between two progress events sent by the
+# subprocess
+PROGRESS_INTERVAL = 0.1
+
+class TriangulationCancelled(TriangulationError):
+    pass
+
+class TriangulationTimeout(TriangulationError):
+    pass
+
+def _triangulate(conn, nodes, edges, size):
+    """
+    Internal function: runs in the subprocess and reports to "conn".
+
+    Sends the final (nodes, edges, elements) in the "done" message.
+    """
+    last = [0.0]
+    def progress(elements, front):
+        now = time.time()
+        if now - last[0] >= PROGRESS_INTERVAL:
+            last[0] = now
+            conn.send(("progress", (elements, front)))
+    try:
+        if size is not None:
+            from sizing import grade_domain
+            nodes, edges = grade_domain(nodes, edges, size)
+        elems = triangulate_regions(nodes, edges, progress)
+    except Exception, e:
+        conn.send(("error", "%s: %s" % (e.__class__.__name__, e)))
+    else:
+        # the last event is never throttled
+        conn.send(("progress", (len(elems), 0)))
+        conn.send(("done", (nodes, edges, elems)))
+    conn.close()
+
+class TriangulationJob:
+    """
+    Handle of a triangulation running in a subprocess.
+
+    It behaves like a future: result() waits for the triangulation and
+    returns the elements (or convert(nodes, edges, elements), if "convert"
+    is given), cancel() kills the subprocess, done() tells whether it has
+    finished. If "size" is given, the domain is graded first (see
+    sizing.grade_domain()), also in the subprocess, and "convert" gets the
+    graded nodes and edges. The latest progress
+    event (elements, front) is available as the "progress" attribute and
+    every event is also passed to the "progress" callback. The last event is
+    (number of elements, 0). If the callback raises an exception, the
+    triangulation is stopped and the job fails with that exception.
+
+    Example:
+
+    >>> job = TriangulationJob([[0, 1], [1, 1], [1, 0], [0, 0]],
+            [(0, 3), (3, 2), (2, 1), (1, 0)])
+    >>> job.result()
+    [(1, 0, 2), (2, 0, 3)]
+
+    """
+
+    def __init__(self, nodes, edges, convert=None, progress=None,
+            timeout=None, size=None):
+        self._convert = convert
+        self._callback = progress
+        self.progress = (0, len(edges))
+        self._result = None
+        self._exception = None
+        self._cancel = False
+        self._finished = threading.Event()
+        self._done_callbacks = []
+        self._lock = threading.Lock()
+        self._conn, child_conn = Pipe(duplex=False)
+        self._process = Process(target=_triangulate,
+                args=(child_conn, nodes, edges, size))
+        self._process.daemon = True
+        self._process.start()
+        child_conn.close()
+        self._deadline = None
+        if timeout is not None:
+            self._deadline = time.time() + timeout
+        self._monitor = threading.Thread(target=self._watch)
+        self._monitor.daemon = True
+        self._monitor.start()
+
+    def _watch(self):
+        """
+        Internal function: collects the messages from the subprocess.
+        """
+        while True:
+            if self._cancel:
+                self._stop(TriangulationCancelled(
+                    "The triangulation was cancelled."))
+                return
+            if self._deadline is not None and time.time() > self._deadline:
+                self._stop(TriangulationTimeout(
+                    "The triangulation timed out."))
+                return
+            if not self._conn.poll(PROGRESS_INTERVAL):
+                if not self._process.is_alive() and not self._conn.poll():
+                    self._stop(TriangulationError(
+                        "The triangulation process died unexpectedly."))
+                    return
+                continue
+            try:
+                kind, value = self._conn.recv()
+            except EOFError:
+                self._stop(TriangulationError(
+                    "The triangulation process died unexpectedly."))
+                return
+            if kind == "progress":
+                self.progress = value
+                if self._callback is not None:
+                    try:
+                        self._callback(*value)
+                    except Exception, e:
+                        # the job must always finish
+                        self._stop(e)
+                        return
+            elif kind == "done":
+                nodes, edges, value = value
+                try:
+                    if self._convert is not None:
+                        value = self._convert(nodes, edges, value)
+                except Exception, e:
+                    self._stop(e)
+                else:
+                    self._result = value
+                    self._stop(None)
+                return
+            else:
+                self._stop(TriangulationError(value))
+                return
+
+    def _stop(self, exception):
+        """
+        Internal function: finishes the job.
+        """
+        self._exception = exception
+        if self._process.is_alive():
+            self._process.terminate()
+        self._process.join()
+        self._conn.close()
+        self._lock.acquire()
+        try:
+            self._finished.set()
+            callbacks = self._done_callbacks[:]
+        finally:
+            self._lock.release()
+        for fn in callbacks:
+            fn(self)
+
+    def cancel(self):
+        """
+        Kills the triangulation. Returns False if it has already finished.
+        """
+        if self.done():
+            return False
+        self._cancel = True
+        self._finished.wait()
+        return True
+
+    def cancelled(self):
+        """
+        Returns True if the triangulation was cancelled.
+        """
+        return isinstance(self._exception, TriangulationCancelled)
+
+    def running(self):
+        """
+        Returns True if the triangulation is still running.
+        """
+        return not self.done()
+
+    def done(self):
+        """
+        Returns True if the triangulation has finished (or was killed).
+        """
+        return self._finished.is_set()
+
+    def add_done_callback(self, fn):
+        """
+        Calls fn(job) once the job is finished (immediately if it already
+        is).
+        """
+        self._lock.acquire()
+        try:
+            if not self._finished.is_set():
+                self._done_callbacks.append(fn)
+                return
+        finally:
+            self._lock.release()
+        fn(self)
+
+    def exception(self, timeout=None):
+        """
+        Waits for the job and returns its exception (None on success).
+        """
+        if not self._finished.wait(timeout):
+            raise TriangulationTimeout("The triangulation is still running.")
+        return self._exception
+
+    def result(self, timeout=None):
+        """
+        Waits (at most "timeout" seconds) for the triangulation and returns
+        it. Raises the exception of the job if it failed.
+        """
+        exception = self.exception(timeout)
+        if exception is not None:
+            raise exception
+        return self._result
@@ -0,0 +1,160 @@
+"""
+Mesh coarsening by edge collapse.
+
+Only triangular meshes are supported. The collapses are "half-edge"
+collapses: an interior node "u" is removed and all its elements are
+reconnected to a neighbor "v" that stays where it is. Boundary nodes are
+never removed, so the boundary edges (and their markers) and the curves are
+preserved exactly.
+"""
+
+from heapq import heapify, heappush, heappop
+from math import hypot
+
+from numpy import array, sqrt, concatenate, zeros, cumsum, inf
+
+def _signed_area(p, a, b, c):
+    (ax, ay), (bx, by), (cx, cy) = p[a], p[b], p[c]
+    return (bx - ax)*(cy - ay) - (by - ay)*(cx - ax)
+
+def coarsen_mesh(nodes, elements, boundaries, curves=[],
+        target_elements=None, max_length=None):
+    """
+    Coarsens the triangular mesh by collapsing its shortest interior edges.
+
+    The edges are collapsed in the order of increasing length (using a
+    priority queue) until the number of elements drops to "target_elements"
+    or until the shortest collapsible edge is longer than "max_length". A
+    collapse is rejected if it would invert or degenerate any element or if
+    it would make the mesh non-manifold.
+
+    Returns a tuple (nodes, elements, boundaries, curves) with the unused
+    nodes removed and the rest renumbered.
+
+    Example:
+
+    >>> nodes = [[0, 0], [2, 0], [2, 2], [0, 2], [1, 1]]
+    >>> elements = [[0, 1, 4], [1, 2, 4], [2, 3, 4], [3, 0, 4]]
+    >>> boundaries = [[0, 1, 1], [1, 2, 2], [2, 3, 3], [3, 0, 4]]
+    >>> coarsen_mesh(nodes, elements, boundaries, target_elements=2)
+    ([[0.0, 0.0], [2.0, 0.0], [2.0, 2.0], [0.0, 2.0]], [[1, 2, 0], [2, 3, 0]], [[0, 1, 1], [1, 2, 2], [2, 3, 3], [3, 0, 4]], [])
+
+    """
+    if target_elements is None and max_length is None:
+        raise ValueError("Specify target_elements or max_length.")
+    if target_elements is None:
+        target_elements = 0
+    if max_length is None:
+        max_length = inf
+    for e in elements:
+        if len(e) != 3:
+            raise NotImplementedError("Only triangular meshes can be coarsened.")
+
+    pts = array(nodes, dtype=float)
+    xy = pts.tolist()
+    n_nodes = len(pts)
+    tris = [list(e) for e in elements]
+    alive = [True] * len(tris)
+    n_alive = len(tris)
+    node_tris = [set() for i in range(n_nodes)]
+    for t, e in enumerate(tris):
+        for n in e:
+            node_tris[n].add(t)
+    on_boundary = zeros(n_nodes, dtype=bool)
+    for b in boundaries:
+        on_boundary[b[0]] = on_boundary[b[1]] = True
+    removed = [False] * n_nodes
+    version = [0] * n_nodes
+
+    def neighbors(n):
+        s = set()
+        for t in node_tris[n]:
+            s.update(tris[t])
+        s.discard(n)
+        return s
+
+    def length(u, v):
+        return hypot(xy[u][0] - xy[v][0], xy[u][1] - xy[v][1])
+
+    def push_edges(n):
+        for w in neighbors(n):
+            if not on_boundary[w]:
+                heappush(heap, (length(w, n), w, n, version[w], version[n]))
+            if not on_boundary[n]:
+                heappush(heap, (length(w, n), n, w, version[n], version[w]))
+
+    # initial queue of all the (interior node -> neighbor) half-edges
+    e = array(tris, dtype=int).reshape(-1, 3)
+    u = concatenate([e[:, 0], e[:, 1], e[:, 2], e[:, 1], e[:, 2], e[:, 0]])
+    v = concatenate([e[:, 1], e[:, 2], e[:, 0], e[:, 0], e[:, 1], e[:, 2]])
+    keep = ~on_boundary[u]
+    u, v = u[keep], v[keep]
+    d = pts[u] - pts[v]
+    lengths = sqrt((d*d).sum(axis=1))
+    heap = list(zip(lengths.tolist(), u.tolist(), v.tolist(),
+        [0]*len(u), [0]*len(u)))
+    heapify(heap)
+    on_boundary = on_boundary.tolist()
+
+    while heap and n_alive > target_elements:
+        l, u, v, ver_u, ver_v = heappop(heap)
+        if l > max_length:
+            break
+        if removed[u] or removed[v] or \
+                ver_u != version[u] or ver_v != version[v]:
+            continue
+        shared = [t for t in node_tris[u] if v in tris[t]]
+        if len(shared) != 2:
+            continue
+        # link condition: the only common neighbors of u and v are the
+        # opposite vertices of the two elements sharing the edge
+        opposite = set()
+        for t in shared:
+            opposite.update(tris[t])
+        opposite.discard(u)
+        opposite.discard(v)
+        if neighbors(u) & neighbors(v) != opposite:
+            continue
+        # the remaining elements of u must keep their orientation
+        ok = True
+        for t in node_tris[u]:
+            if t in shared:
+                continue
+            a, b, c = tris[t]
+            before = _signed_area(xy, a, b, c)
+            a, b, c = [v if n == u else n for n in tris[t]]
+            after = _signed_area(xy, a, b, c)
+            if before*after <= 0 or abs(after) < 1e-12*abs(before):
+                ok = False
+                break
+        if not ok:
+            continue
+
+        for t in shared:
+            alive[t] = False
+            n_alive -= 1
+            for n in tris[t]:
+                node_tris[n].discard(t)
+        for t in node_tris[u]:
+            tris[t] = [v if n == u else n for n in tris[t]]
+            node_tris[v].add(t)
+        node_tris[u] = set()
+        removed[u] = True
+        ring = neighbors(v)
+        version[v] += 1
+        for n in ring:
+            version[n] += 1
+        for n in ring:
+            push_edges(n)
+
+    # renumber the remaining nodes
+    kept = ~array(removed, dtype=bool)
+    new_ids = (cumsum(kept) - 1).tolist()
+    new_nodes = pts[kept].tolist()
+    new_elements = [[new_ids[n] for n in tris[t]]
+            for t in range(len(tris)) if alive[t]]
+    new_boundaries = [[new_ids[b[0]], new_ids[b[1]]] + list(b[2:])
+            for b in boundaries]
+    new_curves = [[new_ids[c[0]], new_ids[c[1]]] + list(c[2:])
+            for c in curves]
+    return new_nodes, new_elements, new_boundaries, new_curves
@@ -46,6 +46,83 @@ class Domain:
         d.normalize()
         return d
 
+    @classmethod
+    def from_poly(cls, filename):
+        """
+        Constructs the Domain() class from the Triangle .poly file.
+
+        Only the vertices and segments are used, the holes are found from the
+        nesting of the boundary loops.
+
+        Example:
+
+        >>> d = Domain.from_poly("square.poly")
+        >>> d.edges
+        [(0, 3), (3, 2), (2, 1), (1, 0)]
+
+        """
+        from geometry_io import read_poly
+        nodes, edges = read_poly(filename)
+        return Domain(nodes, edges)
+
+    @classmethod
+    def from_wkt(cls, text):
+        """
+        Constructs the Domain() class from the WKT POLYGON or MULTIPOLYGON.
+
+        Example:
+
+        >>> d = Domain.from_wkt("POLYGON ((0 0, 1 0, 1 1, 0 1, 0 0))")
+        >>> d.nodes
+        [[0.0, 0.0], [1.0, 0.0], [1.0, 1.0], [0.0, 1.0]]
+        >>> d.edges
+        [(0, 1), (1, 2), (2, 3), (3, 0)]
+
+        """
+        from geometry_io import parse_wkt
+        nodes, edges = parse_wkt(text)
+        return Domain(nodes, edges)
+
+    @classmethod
+    def from_geojson(cls, obj):
+        """
+        Constructs the Domain() class from the GeoJSON polygons.
+
+        "obj" can be a file name, a JSON string or the decoded object. All
+        the Polygon and MultiPolygon geometries are used.
+
+        Example:
+
+        >>> d = Domain.from_geojson('{"type": "Polygon", "coordinates": '
+                '[[[0, 0], [1, 0], [1, 1], [0, 1], [0, 0]]]}')
+        >>> d.edges
+        [(0, 1), (1, 2), (2, 3), (3, 0)]
+
+        """
+        from geometry_io import parse_geojson
+        nodes, edges = parse_geojson(obj)
+        return Domain(nodes, edges)
+
+    @classmethod
+    def from_csv(cls, filename, delimiter=","):
+        """
+        Constructs the Domain() class from the CSV file with the outlines.
+
+        Each line holds "x, y" of one point. The outlines (the outer boundary
+        and the holes) are separated by an empty line or by an id in the
+        third column.
+
+        Example:
+
+        >>> d = Domain.from_csv("square.csv")
+        >>> d.edges
+        [(0, 1), (1, 2), (2, 3), (3, 0)]
+
+        """
+        from geometry_io import read_csv
+        nodes, edges = read_csv(filename, delimiter)
+        return Domain(nodes, edges)
+
     def __init__(self, nodes=[], edges=[]):
         from triangulation import (find_loops, orient_loops,
                 any_edges_intersect)
@@ -254,7 +331,8 @@ onclick="cell_delete_output(%(cell_id)s);">Close</button></td></tr></tbody></tab
         """
         Calculates the (oriented) area of the domain.
 
-        It ignores any possible holes in the domain.
+        The boundary edges are oriented, so the areas of the holes are
+        subtracted.
 
         Example:
 
@@ -269,12 +347,20 @@ onclick="cell_delete_output(%(cell_id)s);">Close</button></td></tr></tbody></tab
         from triangulation import polygon_area
         return polygon_area(self._nodes, self._edges)
 
-    def triangulate(self, debug=False):
+    def triangulate(self, debug=False, size=None):
         """
         Triangulate the domain.
 
         Returns an instance of the Mesh() class that contains the triangular
-        mesh.
+        mesh. Each disjoint region of the domain (e.g. an island inside a
+        hole) is triangulated independently.
+
+        By default only the domain nodes are used. If "size" is given, the
+        boundary edges are subdivided and interior points are added so that
+        the elements follow the requested size: "size" can be a number, a
+        function size(x, y) of NumPy arrays, a list of sizes at the domain
+        nodes, or "auto" to grade the mesh by the local feature size of the
+        boundary (small elements near corners and narrow parts).
 
         Example:
 
@@ -288,19 +374,65 @@ onclick="cell_delete_output(%(cell_id)s);">Close</button></td></tr></tbody></tab
         [(1, 0, 2), (2, 0, 3)]
         >>> m.boundaries
         [[0, 3, 1], [3, 2, 1], [2, 1, 1], [1, 0, 1]]
+        >>> m = d.triangulate(size=lambda x, y: 0.05 + 0.3*x)
+        >>> len(m.elements)
+        107
 
         """
-        from triangulation import triangulate_af
+        from triangulation import triangulate_regions
+        nodes, edges = self._triangulation_input(size)
         if debug:
             print "Triangulating..."
-            print "List of points:", self._nodes
-            print "List of boundary edges:", self._edges
-        elems = triangulate_af(self._nodes, self._edges)
-        boundaries = [list(b)+[1] for b in self._edges]
+            print "List of points:", nodes
+            print "List of boundary edges:", edges
+        elems = triangulate_regions(nodes, edges)
+        mesh = self._mesh(nodes, edges, elems)
         if debug:
             print "List of elements:", elems
-            print "List of boundaries:", boundaries
-        return Mesh(self._nodes, elems, boundaries)
+            print "List of boundaries:", mesh.boundaries
+        return mesh
+
+    def triangulate_async(self, progress=None, timeout=None, size=None):
+        """
+        Triangulates the domain in a subprocess.
+
+        Returns a TriangulationJob immediately, so the notebook stays
+        responsive. job.result() waits for and returns the Mesh(),
+        job.cancel() kills the subprocess. If "timeout" (in seconds) is
+        given, the job is killed once it runs longer. The "progress" callback
+        is called (in a background thread) as progress(elements, front) with
+        the number of elements created so far and the current size of the
+        advancing front. See triangulate() for "size", the grading of the
+        domain is done in the subprocess too.
+
+        Example:
+
+        >>> d = Domain([[0, 1], [1, 1], [1, 0], [0, 0]], [(0, 3), (3, 2), (2, 1), (1, 0)])
+        >>> job = d.triangulate_async(timeout=60)
+        >>> job.result().elements
+        [(1, 0, 2), (2, 0, 3)]
+
+        """
+        from background import TriangulationJob
+        if len(self._edges) == 0:
+            size = None
+        return TriangulationJob(self._nodes, self._edges, convert=self._mesh,
+                progress=progress, timeout=timeout, size=size)
+
+    def _triangulation_input(self, size):
+        """
+        Internal function: nodes and edges to triangulate.
+        """
+        if size is None or len(self._edges) == 0:
+            return self._nodes, self._edges
+        from sizing import grade_domain
+        return grade_domain(self._nodes, self._edges, size)
+
+    def _mesh(self, nodes, edges, elems):
+        """
+        Internal function: creates the Mesh(), all boundaries have marker 1.
+        """
+        return Mesh(nodes, elems, [list(b)+[1] for b in edges])
 
 class Mesh:
     """
@@ -483,35 +615,324 @@ class Mesh:
         """
         self.plot()
 
+    @classmethod
+    def load(cls, path, mmap=True):
+        """
+        Loads the mesh saved by Mesh.save().
+
+        If "mmap" is True, the nodes, elements and boundaries are memory
+        mapped from the disk instead of being read into memory, so meshes
+        larger than the RAM can be processed with iter_nodes(),
+        iter_elements() and iter_boundaries().
+
+        Example:
+
+        >>> m = Mesh([[0.0,1.0],[1.0,1.0],[1.0,0.0],[0.0,0.0],],[[1,0,2],[2,0,3],],[[2,0,1],[2,0,1],[2,0,1],[2,0,1],],[])
+        >>> m.save("mesh")
+        >>> m = Mesh.load("mesh")
+        >>> m.elements
+        memmap([[1, 0, 2],
+                [2, 0, 3]])
+
+        """
+        from storage import load_mesh
+        nodes, elements, boundaries, curves = load_mesh(path, mmap=mmap)
+        return Mesh(nodes, elements, boundaries, curves)
+
+    def save(self, path):
+        """
+        Saves the mesh into the directory "path" as .npy files.
+
+        The arrays are written block by block. See Mesh.load() for an
+        example.
+        """
+        from storage import save_mesh
+        save_mesh(path, self._nodes, self._elements, self._boundaries,
+                self._curves)
+
+    def iter_nodes(self, chunk_size=100000):
+        """
+        Iterates over the nodes in (n, 2) float arrays of at most
+        "chunk_size" rows.
+
+        Example:
+
+        >>> m = Mesh([[0.0,1.0],[1.0,1.0],[1.0,0.0],[0.0,0.0],],[[1,0,2],[2,0,3],],[[2,0,1],[2,0,1],[2,0,1],[2,0,1],],[])
+        >>> [b.tolist() for b in m.iter_nodes(3)]
+        [[[0.0, 1.0], [1.0, 1.0], [1.0, 0.0]], [[0.0, 0.0]]]
+
+        """
+        from storage import iter_blocks
+        return iter_blocks(self._nodes, chunk_size)
+
+    def iter_elements(self, chunk_size=100000):
+        """
+        Iterates over the elements in integer arrays of at most "chunk_size"
+        rows.
+
+        The blocks have 3 columns for triangles and 4 columns for quads. If
+        the mesh contains both, all the blocks have 4 columns and the
+        triangles are padded with -1.
+
+        Example:
+
+        >>> m = Mesh([[0.0,1.0],[1.0,1.0],[1.0,0.0],[0.0,0.0],],[[1,0,2],[2,0,3],],[[2,0,1],[2,0,1],[2,0,1],[2,0,1],],[])
+        >>> [b.tolist() for b in m.iter_elements(1)]
+        [[[1, 0, 2]], [[2, 0, 3]]]
+
+        """
+        from storage import iter_blocks, row_width
+        return iter_blocks(self._elements, chunk_size, dtype=int,
+                width=row_width(self._elements, 3))
+
+    def iter_boundaries(self, chunk_size=100000):
+        """
+        Iterates over the boundaries in (n, 3) integer arrays of at most
+        "chunk_size" rows.
+
+        Example:
+
+        >>> m = Mesh([[0.0,1.0],[1.0,1.0],[1.0,0.0],[0.0,0.0],],[[1,0,2],[2,0,3],],[[2,0,1],[2,0,1],[2,0,1],[2,0,1],],[])
+        >>> [b.tolist() for b in m.iter_boundaries(2)]
+        [[[2, 0, 1], [2, 0, 1]], [[2, 0, 1], [2, 0, 1]]]
+
+        """
+        from storage import iter_blocks
+        return iter_blocks(self._boundaries, chunk_size, dtype=int)
+
+    def export_vtk(self, filename, point_data=None, cell_data=None):
+        """
+        Exports the mesh into the binary VTK XML file (.vtu).
+
+        "point_data" and "cell_data" are optional dictionaries of nodal and
+        element fields (name -> values). The boundary edges are exported as
+        line cells, their markers are in the "marker" cell array.
+
+        Example:
+
+        >>> m = Mesh([[0.0,1.0],[1.0,1.0],[1.0,0.0],[0.0,0.0],],[[1,0,2],[2,0,3],],[[2,0,1],[2,0,1],[2,0,1],[2,0,1],],[])
+        >>> m.export_vtk("mesh.vtu", point_data={"u": [0, 1, 2, 3]})
+
+        """
+        from export import write_vtk
+        write_vtk(filename, self._nodes, self._elements, self._boundaries,
+                point_data, cell_data)
+
+    def export_xdmf(self, filename, point_data=None, cell_data=None):
+        """
+        Exports the mesh into the XDMF file (.xmf) with raw binary sidecars.
+
+        The sidecar files (mesh.nodes.bin, mesh.elements.bin, ...) are
+        written next to "filename". See export_vtk() for the fields.
+
+        Example:
+
+        >>> m = Mesh([[0.0,1.0],[1.0,1.0],[1.0,0.0],[0.0,0.0],],[[1,0,2],[2,0,3],],[[2,0,1],[2,0,1],[2,0,1],[2,0,1],],[])
+        >>> m.export_xdmf("mesh.xmf", cell_data={"k": [1.0, 2.0]})
+
+        """
+        from export import write_xdmf
+        write_xdmf(filename, self._nodes, self._elements, self._boundaries,
+                point_data, cell_data)
+
+    @classmethod
+    def concatenate(cls, meshes, tol=1e-10):
+        """
+        Glues several meshes into one.
+
+        The nodes closer than "tol" are merged (see merge_duplicate_nodes()),
+        so the meshes sharing an interface become one conforming mesh and the
+        boundary edges on the interface are removed.
+
+        Example:
+
+        >>> m1 = Mesh([[0, 0], [1, 0], [0, 1]], [[0, 1, 2]], [[0, 1, 1], [1, 2, 1], [2, 0, 1]])
+        >>> m2 = Mesh([[1, 0], [1, 1], [0, 1]], [[0, 1, 2]], [[0, 1, 2], [1, 2, 2], [2, 0, 2]])
+        >>> m = Mesh.concatenate([m1, m2])
+        >>> m.nodes
+        [[0.0, 0.0], [1.0, 0.0], [0.0, 1.0], [1.0, 1.0]]
+        >>> m.elements
+        [[0, 1, 2], [1, 3, 2]]
+        >>> m.boundaries
+        [[0, 1, 1], [2, 0, 1], [1, 3, 2], [3, 2, 2]]
+        >>> m = Mesh.concatenate([m1, m1])
+        >>> m.elements
+        [[0, 1, 2]]
+        >>> m.boundaries
+        [[0, 1, 1], [1, 2, 1], [2, 0, 1]]
+
+        """
+        from welding import concatenate_meshes, merge_duplicate_nodes
+        nodes, elements, boundaries, curves = concatenate_meshes(meshes)
+        return Mesh(*merge_duplicate_nodes(nodes, elements, boundaries,
+            curves, tol))
+
+    def merge_duplicate_nodes(self, tol=1e-10):
+        """
+        Returns the mesh with the nodes closer than "tol" merged.
+
+        The elements, boundaries and curves are renumbered, elements that
+        become degenerate or duplicate are dropped and boundary edges that
+        become shared by two elements are removed. A spatial hash is used, so it runs in
+        linear time.
+
+        Example:
+
+        >>> m = Mesh([[0, 0], [1, 0], [0, 1], [1, 0], [1, 1], [0, 1]],
+                [[0, 1, 2], [3, 4, 5]], [], [])
+        >>> m.merge_duplicate_nodes().elements
+        [[0, 1, 2], [1, 3, 2]]
+
+        """
+        from welding import merge_duplicate_nodes
+        return Mesh(*merge_duplicate_nodes(self._nodes, self._elements,
+            self._boundaries, self._curves, tol))
+
+    def validate(self):
+        """
+        Checks that the mesh is conforming.
+
+        Returns a MeshValidation listing the inverted and degenerate
+        elements, edges shared by more than two elements, neighbors with
+        inconsistent orientation, overlapping elements, hanging nodes and
+        the differences between the boundaries and the actual boundary
+        edges. It is true if the mesh is valid. The checks are based on a
+        sorted edge table and a grid of bounding boxes, so they run in
+        O(M log M).
+
+        Example:
+
+        >>> m = Mesh([[0.0,1.0],[1.0,1.0],[1.0,0.0],[0.0,0.0],],[[1,0,2],[2,0,3],],[[2,0,1],[2,0,1],[2,0,1],[2,0,1],],[])
+        >>> v = m.validate()
+        >>> v.valid
+        False
+        >>> v.missing_boundaries
+        [(1, 0), (0, 3), (2, 1), (3, 2)]
+        >>> v.extra_boundaries
+        [0, 1, 2, 3]
+
+        """
+        from validation import validate_mesh
+        return validate_mesh(self._nodes, self._elements, self._boundaries)
+
+    def hierarchy(self, levels):
+        """
+        Returns a hierarchy of nested meshes for geometric multigrid.
+
+        The hierarchy (MeshHierarchy) has "levels" meshes, this mesh being
+        the coarsest one and every next one its uniform refinement (each
+        element split into 4). It also holds the parent/child element maps
+        and the sparse (CSR) prolongation and restriction matrices between
+        the consecutive levels.
+
+        Example:
+
+        >>> m = Mesh([[0.0,1.0],[1.0,1.0],[1.0,0.0],[0.0,0.0],],[[1,0,2],[2,0,3],],[[2,0,1],[2,0,1],[2,0,1],[2,0,1],],[])
+        >>> h = m.hierarchy(3)
+        >>> [len(l.elements) for l in h.meshes]
+        [2, 8, 32]
+        >>> h.restriction(1)
+        <9x25 CSRMatrix with 41 stored entries>
+
+        """
+        from refinement import MeshHierarchy
+        return MeshHierarchy(self, levels)
+
+    def coarsen(self, target_elements=None, max_length=None):
+        """
+        Returns a coarser mesh obtained by collapsing the shortest edges.
+
+        Interior edges are collapsed until the mesh has at most
+        "target_elements" elements or until the shortest collapsible edge is
+        longer than "max_length". The boundary edges and their markers are
+        preserved and no element gets inverted. Only triangular meshes are
+        supported.
+
+        Example:
+
+        >>> m = Mesh([[0, 0], [2, 0], [2, 2], [0, 2], [1, 1]],
+                [[0, 1, 4], [1, 2, 4], [2, 3, 4], [3, 0, 4]],
+                [[0, 1, 1], [1, 2, 2], [2, 3, 3], [3, 0, 4]])
+        >>> m.coarsen(target_elements=2).elements
+        [[1, 2, 0], [2, 3, 0]]
+
+        """
+        from coarsening import coarsen_mesh
+        nodes, elements, boundaries, curves = coarsen_mesh(self._nodes,
+                self._elements, self._boundaries, self._curves,
+                target_elements=target_elements, max_length=max_length)
+        return Mesh(nodes, elements, boundaries, curves)
+
+    def to_quads(self, method="merge", min_quality=0.5):
+        """
+        Returns a mesh with quad elements.
+
+        method="merge" pairs neighboring triangles into quads, the best ones
+        first, keeping only the quads with the quality (1 - the maximal
+        deviation of the angles from 90 degrees relative to 90 degrees) at
+        least "min_quality". The result is a quad-dominant mesh with the same
+        nodes and boundaries. method="split" splits every triangle into 3
+        quads (and every quad into 4) through the edge midpoints and the
+        center, giving an all-quad mesh.
+
+        Example:
+
+        >>> m = Mesh([[0.0,1.0],[1.0,1.0],[1.0,0.0],[0.0,0.0],],[[1,0,2],[2,0,3],],[[2,0,1],[2,0,1],[2,0,1],[2,0,1],],[])
+        >>> m.to_quads().elements
+        [[2, 1, 0, 3]]
+        >>> len(m.to_quads("split").elements)
+        6
+
+        """
+        if method == "merge":
+            from quads import merge_to_quads
+            elements = merge_to_quads(self._nodes, self._elements,
+                    min_quality)
+            return Mesh(self._nodes, elements, self._boundaries, self._curves)
+        elif method == "split":
+            if len(self._curves) != 0:
+                raise NotImplementedError("Splitting of curved meshes is not supported.")
+            from quads import split_to_quads
+            return Mesh(*split_to_quads(self._nodes, self._elements,
+                self._boundaries))
+        else:
+            raise ValueError("Unknown method: %s" % method)
+
     def _convert_nodes(self, a):
         """
         Internal function: prepares nodes for the flash.
         """
-        s = ""
-        for x, y in a:
-            s += "%s %s," % (x, y)
-        return s
+        from storage import iter_blocks
+        s = []
+        for block in iter_blocks(a):
+            s.extend(["%s %s," % (x, y) for x, y in block.tolist()])
+        return "".join(s)
 
     def _convert_elements(self, a):
         """
         Internal function: prepares elements for the flash.
         """
-        s = ""
-        for e in a:
-            if len(e) == 3:
-                s += "%s %s %s 0," % tuple(e)
-            elif len(e) == 4:
-                s += "%s %s %s %s 0," % tuple(e)
-        return s
+        from storage import iter_blocks
+        s = []
+        for block in iter_blocks(a, dtype=int):
+            for e in block.tolist():
+                if len(e) == 4 and e[3] == -1:
+                    e = e[:3]
+                if len(e) == 3:
+                    s.append("%s %s %s 0," % tuple(e))
+                elif len(e) == 4:
+                    s.append("%s %s %s %s 0," % tuple(e))
+        return "".join(s)
 
     def _convert_boundaries(self, a):
         """
         Internal function: prepares boundaries for the flash.
         """
-        s = ""
-        for b in a:
-            s += ("%s %s %s,") % tuple(b)
-        return s
+        from storage import iter_blocks
+        s = []
+        for block in iter_blocks(a, dtype=int):
+            s.extend([("%s %s %s,") % tuple(b) for b in block.tolist()])
+        return "".join(s)
 
     def _convert_curves(self, a):
         """
@@ -583,7 +1004,8 @@ class Mesh:
             from hermes2d import Mesh
             m = Mesh()
             nodes = self._nodes
-            elements = [list(e)+[0] for e in self._elements]
+            # the elements of loaded mixed meshes are padded with -1
+            elements = [[i for i in e if i != -1]+[0] for e in self._elements]
             boundaries = self._boundaries
             curves = self._curves
             m.create(nodes, elements, boundaries, curves)
@@ -0,0 +1,321 @@
+"""
+Binary export of meshes for visualization (ParaView, VisIt, ...).
+
+Two formats are supported:
+
+* VTK XML unstructured grid (.vtu) with the data appended as raw binary
+* XDMF (.xmf) with the data in raw binary sidecar files (no HDF5 needed)
+
+The arrays are written block by block straight from NumPy, no text
+formatting of the numbers is involved. The boundaries are exported as line
+cells with their markers.
+"""
+
+import os
+
+from numpy import array, asarray, zeros, full, arange, nan
+
+from storage import iter_blocks, CHUNK_SIZE
+
+# VTK cell types
+VTK_LINE = 3
+VTK_TRIANGLE = 5
+VTK_QUAD = 9
+
+# XDMF mixed topology cell types
+XDMF_TRIANGLE = 4
+XDMF_QUADRILATERAL = 5
+
+# names of the arrays written for every mesh, not allowed for the fields
+RESERVED_NAMES = ("nodes", "elements", "boundaries", "marker", "markers")
+
+_vtk_types = {"f8": "Float64", "i8": "Int64", "u1": "UInt8"}
+
+def _count_cells(elements, chunk_size):
+    """
+    Returns (number of elements, number of quads) in "elements".
+    """
+    n = 0
+    n_quads = 0
+    for block in iter_blocks(elements, chunk_size, dtype=int):
+        n += len(block)
+        if block.shape[1] == 4:
+            n_quads += int((block[:, 3] != -1).sum())
+    return n, n_quads
+
+def _as_field(values, n, name):
+    a = asarray(values, dtype="<f8")
+    if a.ndim == 1:
+        a = a.reshape(-1, 1)
+    if len(a) != n:
+        raise ValueError("The field '%s' has %d values, %d expected." %
+                (name, len(a), n))
+    return a
+
+def _check_names(point_data, cell_data):
+    for name in list(point_data) + list(cell_data):
+        if name in RESERVED_NAMES:
+            raise ValueError("The field name '%s' is reserved." % name)
+
+def _padded_cell_field(a, n_boundaries):
+    # boundary line cells don't carry the element fields
+    out = full((len(a) + n_boundaries, a.shape[1]), nan, dtype="<f8")
+    out[:len(a)] = a
+    return out
+
+class _VTKAppended:
+    """
+    Internal class: collects the appended arrays and their offsets.
+    """
+
+    def __init__(self):
+        self.arrays = []
+        self.offset = 0
+
+    def add(self, name, dtype, components, nbytes, writer):
+        xml = ('<DataArray type="%s" Name="%s" NumberOfComponents="%d" '
+                'format="appended" offset="%d"/>' % (_vtk_types[dtype], name,
+                    components, self.offset))
+        self.arrays.append((nbytes, writer))
+        self.offset += 8 + nbytes
+        return xml
+
+    def write(self, f):
+        f.write("_")
+        for nbytes, writer in self.arrays:
+            array([nbytes], dtype="<u8").tofile(f)
+            writer(f)
+
+def write_vtk(filename, nodes, elements, boundaries, point_data=None,
+        cell_data=None, chunk_size=CHUNK_SIZE):
+    """
+    Writes the mesh into the VTK XML (.vtu) file with raw appended data.
+
+    "point_data" and "cell_data" are dictionaries of name -> values with one
+    value (or one row of components) per node or per element, the names in
+    RESERVED_NAMES are not allowed. The elements
+    are followed by the boundary edges as line cells; the "marker" cell array
+    contains the boundary markers (0 for the elements).
+    """
+    point_data = point_data or {}
+    cell_data = cell_data or {}
+    _check_names(point_data, cell_data)
+    n_nodes = len(nodes)
+    n_elements, n_quads = _count_cells(elements, chunk_size)
+    n_boundaries = len(boundaries)
+    n_cells = n_elements + n_boundaries
+    n_conn = 3*n_elements + n_quads + 2*n_boundaries
+    appended = _VTKAppended()
+
+    def write_points(f):
+        for block in iter_blocks(nodes, chunk_size):
+            p = zeros((len(block), 3), dtype="<f8")
+            p[:, :block.shape[1]] = block[:, :3]
+            p.tofile(f)
+
+    def write_connectivity(f):
+        for block in iter_blocks(elements, chunk_size, dtype=int):
+            block = block[block != -1]
+            block.astype("<i8").tofile(f)
+        for block in iter_blocks(boundaries, chunk_size, dtype=int):
+            block[:, :2].astype("<i8").tofile(f)
+
+    def write_offsets(f):
+        last = 0
+        for block in iter_blocks(elements, chunk_size, dtype=int):
+            o = last + (block != -1).sum(axis=1).cumsum()
+            o.astype("<i8").tofile(f)
+            if len(o):
+                last = o[-1]
+        for block in iter_blocks(boundaries, chunk_size, dtype=int):
+            (last + 2*arange(1, len(block) + 1)).astype("<i8").tofile(f)
+            last += 2*len(block)
+
+    def write_types(f):
+        for block in iter_blocks(elements, chunk_size, dtype=int):
+            t = full(len(block), VTK_TRIANGLE, dtype="u1")
+            if block.shape[1] == 4:
+                t[block[:, 3] != -1] = VTK_QUAD
+            t.tofile(f)
+        full(n_boundaries, VTK_LINE, dtype="u1").tofile(f)
+
+    def write_markers(f):
+        zeros(n_elements, dtype="<i8").tofile(f)
+        for block in iter_blocks(boundaries, chunk_size, dtype=int):
+            block[:, 2].astype("<i8").tofile(f)
+
+    def array_writer(a):
+        return lambda f: a.tofile(f)
+
+    points_xml = appended.add("Points", "f8", 3, 24*n_nodes, write_points)
+    cells_xml = [
+        appended.add("connectivity", "i8", 1, 8*n_conn, write_connectivity),
+        appended.add("offsets", "i8", 1, 8*n_cells, write_offsets),
+        appended.add("types", "u1", 1, n_cells, write_types),
+        ]
+    point_xml = []
+    for name in sorted(point_data):
+        a = _as_field(point_data[name], n_nodes, name)
+        point_xml.append(appended.add(name, "f8", a.shape[1], a.nbytes,
+            array_writer(a)))
+    cell_xml = [appended.add("marker", "i8", 1, 8*n_cells, write_markers)]
+    for name in sorted(cell_data):
+        a = _padded_cell_field(_as_field(cell_data[name], n_elements, name),
+                n_boundaries)
+        cell_xml.append(appended.add(name, "f8", a.shape[1], a.nbytes,
+            array_writer(a)))
+
+    f = open(filename, "wb")
+    try:
+        f.write("""\
+<?xml version="1.0"?>
+<VTKFile type="UnstructuredGrid" version="1.0" byte_order="LittleEndian" header_type="UInt64">
+<UnstructuredGrid>
+<Piece NumberOfPoints="%(n_nodes)d" NumberOfCells="%(n_cells)d">
+<Points>
+%(points)s
+</Points>
+<Cells>
+%(cells)s
+</Cells>
+<PointData>
+%(point_data)s
+</PointData>
+<CellData>
+%(cell_data)s
+</CellData>
+</Piece>
+</UnstructuredGrid>
+<AppendedData encoding="raw">
+""" % {"n_nodes": n_nodes, "n_cells": n_cells, "points": points_xml,
+        "cells": "\n".join(cells_xml), "point_data": "\n".join(point_xml),
+        "cell_data": "\n".join(cell_xml)})
+        appended.write(f)
+        f.write("""
+</AppendedData>
+</VTKFile>
+""")
+    finally:
+        f.close()
+
+def _data_item(filename, dims, number_type, precision):
+    return ('<DataItem Format="Binary" Endian="Little" NumberType="%s" '
+            'Precision="%d" Dimensions="%s">%s</DataItem>' % (number_type,
+                precision, " ".join([str(d) for d in dims]), filename))
+
+def write_xdmf(filename, nodes, elements, boundaries, point_data=None,
+        cell_data=None, chunk_size=CHUNK_SIZE):
+    """
+    Writes the mesh into the XDMF (.xmf) file with raw binary sidecars.
+
+    The sidecar files are named after "filename" (e.g. mesh.xmf,
+    mesh.nodes.bin, mesh.elements.bin, mesh.point_u.bin, mesh.cell_u.bin,
+    ...) and stored next to it. The mesh
+    and its boundaries (with the "marker" attribute) are two grids in a
+    spatial collection. See write_vtk() for "point_data" and "cell_data".
+    """
+    point_data = point_data or {}
+    cell_data = cell_data or {}
+    _check_names(point_data, cell_data)
+    base = os.path.splitext(filename)[0]
+    rel = os.path.basename(base)
+    n_nodes = len(nodes)
+    n_elements, n_quads = _count_cells(elements, chunk_size)
+    n_boundaries = len(boundaries)
+
+    def sidecar(name):
+        return open("%s.%s.bin" % (base, name), "wb"), "%s.%s.bin" % (rel,
+                name)
+
+    f, nodes_file = sidecar("nodes")
+    try:
+        for block in iter_blocks(nodes, chunk_size):
+            block[:, :2].astype("<f8").tofile(f)
+    finally:
+        f.close()
+    geometry = ('<Geometry GeometryType="XY">%s</Geometry>' %
+            _data_item(nodes_file, (n_nodes, 2), "Float", 8))
+
+    f, elements_file = sidecar("elements")
+    try:
+        for block in iter_blocks(elements, chunk_size, dtype=int):
+            if n_quads in (0, n_elements):
+                block[:, :4 if n_quads else 3].astype("<i8").tofile(f)
+                continue
+            # mixed topology: every cell is preceded by its type (the blocks
+            # with triangles only are not padded)
+            mixed = full((len(block), 5), -1, dtype="<i8")
+            mixed[:, 0] = XDMF_TRIANGLE
+            if block.shape[1] == 4:
+                mixed[block[:, 3] != -1, 0] = XDMF_QUADRILATERAL
+            mixed[:, 1:1 + block.shape[1]] = block
+            mixed[mixed != -1].tofile(f)
+    finally:
+        f.close()
+    if n_quads == 0:
+        topology = ('<Topology TopologyType="Triangle" '
+                'NumberOfElements="%d">%s</Topology>' % (n_elements,
+                    _data_item(elements_file, (n_elements, 3), "Int", 8)))
+    elif n_quads == n_elements:
+        topology = ('<Topology TopologyType="Quadrilateral" '
+                'NumberOfElements="%d">%s</Topology>' % (n_elements,
+                    _data_item(elements_file, (n_elements, 4), "Int", 8)))
+    else:
+        size = 4*n_elements + n_quads
+        topology = ('<Topology TopologyType="Mixed" '
+                'NumberOfElements="%d">%s</Topology>' % (n_elements,
+                    _data_item(elements_file, (size,), "Int", 8)))
+
+    attributes = []
+    for center, prefix, data, n in [("Node", "point", point_data, n_nodes),
+            ("Cell", "cell", cell_data, n_elements)]:
+        for name in sorted(data):
+            a = _as_field(data[name], n, name)
+            f, field_file = sidecar("%s_%s" % (prefix, name))
+            try:
+                a.tofile(f)
+            finally:
+                f.close()
+            kind = "Scalar"
+            if a.shape[1] > 1:
+                kind = "Vector"
+            attributes.append('<Attribute Name="%s" AttributeType="%s" '
+                    'Center="%s">%s</Attribute>' % (name, kind, center,
+                        _data_item(field_file, a.shape, "Float", 8)))
+
+    f, edges_file = sidecar("boundaries")
+    g, markers_file = sidecar("markers")
+    try:
+        for block in iter_blocks(boundaries, chunk_size, dtype=int):
+            block[:, :2].astype("<i8").tofile(f)
+            block[:, 2].astype("<i8").tofile(g)
+    finally:
+        f.close()
+        g.close()
+
+    f = open(filename, "w")
+    try:
+        f.write("""\
+<?xml version="1.0"?>
+<Xdmf Version="3.0">
+<Domain>
+<Grid Name="mesh" GridType="Collection" CollectionType="Spatial">
+<Grid Name="elements" GridType="Uniform">
+%(topology)s
+%(geometry)s
+%(attributes)s
+</Grid>
+<Grid Name="boundaries" GridType="Uniform">
+<Topology TopologyType="Polyline" NodesPerElement="2" NumberOfElements="%(n_boundaries)d">%(edges)s</Topology>
+%(geometry)s
+<Attribute Name="marker" AttributeType="Scalar" Center="Cell">%(markers)s</Attribute>
+</Grid>
+</Grid>
+</Domain>
+</Xdmf>
+""" % {"topology": topology, "geometry": geometry,
+        "attributes": "\n".join(attributes), "n_boundaries": n_boundaries,
+        "edges": _data_item(edges_file, (n_boundaries, 2), "Int", 8),
+        "markers": _data_item(markers_file, (n_boundaries,), "Int", 8)})
+    finally:
+        f.close()
@@ -0,0 +1,214 @@
+"""
+Readers of polygonal geometries from standard file formats.
+
+All the readers return a tuple (nodes, edges) in the format accepted by
+Domain(): "nodes" is a list of [x, y] and "edges" a list of (a, b) tuples of
+node ids. The coordinates are parsed in blocks straight into NumPy arrays,
+so boundaries with hundreds of thousands of vertices load quickly.
+"""
+
+import re
+import json
+
+from numpy import array, arange, concatenate, fromstring, roll, zeros
+
+def _strip_comment(line):
+    i = line.find("#")
+    if i != -1:
+        line = line[:i]
+    return line.strip()
+
+def _data_lines(f):
+    """
+    Iterates over the lines of "f" that are not empty after stripping the
+    "#" comments.
+    """
+    for line in f:
+        line = _strip_comment(line)
+        if line:
+            yield line
+
+def _read_block(lines, n):
+    """
+    Reads "n" lines of numbers into a 2D float array.
+    """
+    if n == 0:
+        return zeros((0, 0))
+    text = []
+    for i in range(n):
+        text.append(next(lines))
+    width = len(text[0].split())
+    a = fromstring(" ".join(text), sep=" ")
+    if len(a) != n*width:
+        raise ValueError("Inconsistent number of columns.")
+    return a.reshape(n, width)
+
+def rings_to_edges(rings):
+    """
+    Converts a list of rings (arrays of points) into nodes and edges.
+
+    The last point of a ring can repeat the first one (as in WKT and
+    GeoJSON), it is removed in that case.
+
+    Example:
+
+    >>> rings_to_edges([[[0, 0], [1, 0], [1, 1], [0, 0]]])
+    ([[0.0, 0.0], [1.0, 0.0], [1.0, 1.0]], [(0, 1), (1, 2), (2, 0)])
+
+    """
+    nodes = []
+    edges = []
+    offset = 0
+    for ring in rings:
+        ring = array(ring, dtype=float)[:, :2]
+        if len(ring) > 1 and (ring[0] == ring[-1]).all():
+            ring = ring[:-1]
+        if len(ring) < 3:
+            raise ValueError("A ring must have at least 3 points.")
+        ids = arange(offset, offset + len(ring))
+        nodes.append(ring)
+        edges.append(array([ids, roll(ids, -1)]).T)
+        offset += len(ring)
+    if offset == 0:
+        return [], []
+    nodes = concatenate(nodes).tolist()
+    edges = [tuple(e) for e in concatenate(edges).tolist()]
+    return nodes, edges
+
+def read_poly(filename):
+    """
+    Reads the Triangle .poly file.
+
+    The vertices and segments are read, the holes and regional attributes
+    are ignored (holes are recognized from the nesting of the boundary
+    loops). Vertex numbering can start either from 0 or 1.
+    """
+    f = open(filename)
+    try:
+        lines = _data_lines(f)
+        header = next(lines).split()
+        n_vertices = int(header[0])
+        if n_vertices == 0:
+            raise ValueError("The vertices are expected in the .poly file.")
+        vertices = _read_block(lines, n_vertices)
+        n_segments = int(next(lines).split()[0])
+        segments = _read_block(lines, n_segments)
+    finally:
+        f.close()
+    ids = vertices[:, 0].astype(int)
+    first = ids.min()
+    index = zeros(ids.max() - first + 1, dtype=int)
+    index[ids - first] = arange(len(ids))
+    nodes = vertices[:, 1:3].tolist()
+    if n_segments == 0:
+        return nodes, []
+    seg = index[segments[:, 1:3].astype(int) - first]
+    edges = [tuple(e) for e in seg.tolist()]
+    return nodes, edges
+
+_ring_re = re.compile(r"\(([^()]*)\)")
+
+def parse_wkt(text):
+    """
+    Parses the WKT POLYGON or MULTIPOLYGON (possibly with holes).
+
+    Example:
+
+    >>> parse_wkt("POLYGON ((0 0, 3 0, 3 3, 0 3, 0 0), (1 1, 1 2, 2 2, 2 1, 1 1))")
+    ([[0.0, 0.0], [3.0, 0.0], [3.0, 3.0], [0.0, 3.0], [1.0, 1.0], [1.0, 2.0], [2.0, 2.0], [2.0, 1.0]], [(0, 1), (1, 2), (2, 3), (3, 0), (4, 5), (5, 6), (6, 7), (7, 4)])
+
+    """
+    kind = text.strip().split("(")[0].split()
+    if not kind or kind[0].upper() not in ["POLYGON", "MULTIPOLYGON"]:
+        raise ValueError("Only POLYGON and MULTIPOLYGON are supported.")
+    rings = []
+    for ring in _ring_re.findall(text):
+        points = ring.split(",")
+        width = len(points[0].split())
+        a = fromstring(ring.replace(",", " "), sep=" ")
+        rings.append(a.reshape(-1, width))
+    return rings_to_edges(rings)
+
+def _geojson_polygons(obj):
+    """
+    Iterates over the polygons (lists of rings) in the GeoJSON object.
+    """
+    t = obj.get("type")
+    if t == "FeatureCollection":
+        for feature in obj["features"]:
+            for p in _geojson_polygons(feature):
+                yield p
+    elif t == "Feature":
+        for p in _geojson_polygons(obj["geometry"]):
+            yield p
+    elif t == "GeometryCollection":
+        for g in obj["geometries"]:
+            for p in _geojson_polygons(g):
+                yield p
+    elif t == "Polygon":
+        yield obj["coordinates"]
+    elif t == "MultiPolygon":
+        for p in obj["coordinates"]:
+            yield p
+    else:
+        raise ValueError("Unsupported GeoJSON type: %s" % t)
+
+def parse_geojson(obj):
+    """
+    Reads the polygons (with holes) from the GeoJSON object.
+
+    "obj" can be the decoded object, a JSON string or a file name.
+    """
+    if isinstance(obj, basestring):
+        if obj.lstrip().startswith("{"):
+            obj = json.loads(obj)
+        else:
+            f = open(obj)
+            try:
+                obj = json.load(f)
+            finally:
+                f.close()
+    rings = []
+    for polygon in _geojson_polygons(obj):
+        rings.extend(polygon)
+    return rings_to_edges(rings)
+
+def read_csv(filename, delimiter=","):
+    """
+    Reads the outlines from the CSV file.
+
+    Each line contains "x, y" of one point, the rings are separated by an
+    empty line or, alternatively, a third column gives the ring id. A header
+    line (not starting with a number) is skipped.
+    """
+    rings = []
+    ring = []
+    ring_id = None
+    f = open(filename)
+    try:
+        for line in f:
+            line = line.strip()
+            if not line:
+                if ring:
+                    rings.append(ring)
+                ring = []
+                continue
+            row = line.split(delimiter)
+            try:
+                x, y = float(row[0]), float(row[1])
+            except ValueError:
+                if not rings and not ring:
+                    # header
+                    continue
+                raise
+            if len(row) > 2 and row[2].strip() != ring_id:
+                if ring:
+                    rings.append(ring)
+                ring = []
+                ring_id = row[2].strip()
+            ring.append((x, y))
+    finally:
+        f.close()
+    if ring:
+        rings.append(ring)
+    return rings_to_edges(rings)
@@ -0,0 +1,190 @@
+"""
+Batched geometric predicates.
+
+The predicates are evaluated for many candidates at once on arrays of
+coordinates (any shapes that broadcast together). The orientation test is
+adaptive: it is computed in floating point with a forward error bound and
+only the nearly degenerate cases, where the sign of the floating point
+result is not certain, are recomputed exactly in integer arithmetic. So
+the signs are always correct and the exact path is only taken for
+nearly collinear points.
+
+The candidate pairs for the pairwise tests (e.g. crossing segments) are
+found by box_pairs() in a hierarchy of uniform grids, so only the nearby
+pairs are tested.
+"""
+
+from numpy import (asarray, broadcast_arrays, absolute, nonzero, sqrt, errstate,
+        int8, minimum, maximum, zeros, arange, ceil, log2, floor, concatenate,
+        repeat, lexsort, cumsum, unique, diff)
+
+# relative error bound of the floating point orientation determinant
+# (Shewchuk, "Adaptive Precision Floating-Point Arithmetic and Fast Robust
+# Geometric Predicates")
+EPSILON = 2.0**-53
+ORIENTATION_BOUND = (3 + 16*EPSILON)*EPSILON
+
+def _exact_orientation(*coords):
+    """
+    Returns the sign of the orientation determinant in exact arithmetic.
+
+    The floats are m / 2**k, so they are scaled to integers with the
+    largest denominator and the determinant is evaluated with Python longs.
+    """
+    ratios = [float(v).as_integer_ratio() for v in coords]
+    scale = max([d for n, d in ratios])
+    ax, ay, bx, by, cx, cy = [n*(scale // d) for n, d in ratios]
+    det = (ax - cx)*(by - cy) - (ay - cy)*(bx - cx)
+    return (det > 0) - (det < 0)
+
+def orientation(ax, ay, bx, by, cx, cy):
+    """
+    Returns the orientation of the triangles (a, b, c): 1 if c lies on the
+    left of the line a -> b (counterclockwise), -1 if on the right and 0 if
+    the points are collinear.
+
+    Example:
+
+    >>> orientation(0, 0, 1, 0, [0.5, 0.5, 2], [1, -1, 0])
+    array([ 1, -1,  0], dtype=int8)
+    >>> orientation(0.5, 0.5, 12, 12, 24, 24.000000000000004)
+    array(1, dtype=int8)
+
+    """
+    coords = broadcast_arrays(*[asarray(v, dtype=float)
+        for v in (ax, ay, bx, by, cx, cy)])
+    shape = coords[0].shape
+    ax, ay, bx, by, cx, cy = [v.ravel() for v in coords]
+    left = (ax - cx)*(by - cy)
+    right = (ay - cy)*(bx - cx)
+    det = left - right
+    bound = ORIENTATION_BOUND*(absolute(left) + absolute(right))
+    sign = (det > bound).astype(int8) - (det < -bound).astype(int8)
+    uncertain = (absolute(det) <= bound) & (bound > 0)
+    # with two coincident points the determinant is exactly 0 anyway
+    uncertain &= ~(((ax == bx) & (ay == by)) | ((bx == cx) & (by == cy)) |
+            ((cx == ax) & (cy == ay)))
+    for i in nonzero(uncertain)[0]:
+        sign[i] = _exact_orientation(ax[i], ay[i], bx[i], by[i], cx[i], cy[i])
+    return sign.reshape(shape)
+
+def angle_criterion(ax, ay, bx, by, cx, cy):
+    """
+    Returns the cosine of the angle acb (the advancing front criterion,
+    the smaller the better). It is NaN if c coincides with a or b.
+
+    Example:
+
+    >>> angle_criterion(0, 0, 1, 0, [0.5, 0.5], [0.5, 2])
+    array([0.        , 0.88235294])
+
+    """
+    ux = asarray(ax, dtype=float) - cx
+    uy = asarray(ay, dtype=float) - cy
+    vx = asarray(bx, dtype=float) - cx
+    vy = asarray(by, dtype=float) - cy
+    with errstate(divide="ignore", invalid="ignore"):
+        return (ux*vx + uy*vy) / sqrt((ux*ux + uy*uy)*(vx*vx + vy*vy))
+
+def segments_intersect(ax, ay, bx, by, cx, cy, dx, dy):
+    """
+    Returns whether the segments ab and cd cross.
+
+    The test is the one of triangulation.intersect(): the end points of
+    each segment must lie strictly on the left of the other segment for one
+    end point and not for the other one.
+
+    Example:
+
+    >>> segments_intersect(0, 0, 1, 1, [0, 2], [1, 2], [1, 3], [0, 3])
+    array([ True, False])
+
+    """
+    coords = broadcast_arrays(*[asarray(v, dtype=float)
+        for v in (ax, ay, bx, by, cx, cy, dx, dy)])
+    ax, ay, bx, by, cx, cy, dx, dy = coords
+    # only the pairs with overlapping bounding boxes can cross
+    near = (minimum(ax, bx) <= maximum(cx, dx)) & \
+            (minimum(cx, dx) <= maximum(ax, bx)) & \
+            (minimum(ay, by) <= maximum(cy, dy)) & \
+            (minimum(cy, dy) <= maximum(ay, by))
+    ax, ay, bx, by, cx, cy, dx, dy = [v[near] for v in coords]
+    acd = orientation(ax, ay, cx, cy, dx, dy) > 0
+    bcd = orientation(bx, by, cx, cy, dx, dy) > 0
+    abc = orientation(ax, ay, bx, by, cx, cy) > 0
+    abd = orientation(ax, ay, bx, by, dx, dy) > 0
+    result = zeros(near.shape, dtype=bool)
+    result[near] = (acd != bcd) & (abc != abd)
+    return result
+
+def box_pairs(x_min, y_min, x_max, y_max):
+    """
+    Returns the arrays (p, q), p < q, of the pairs of overlapping boxes.
+
+    Every box is binned into the grid whose cells are at least as large as
+    the box (the cell sizes are h*2**level, h being the smallest box), so it
+    covers at most 2x2 cells. The pairs are collected from the cells of the
+    grid of the larger box of the pair. So the work is proportional to the
+    number of boxes times the number of levels plus the number of pairs,
+    also for boxes of very different sizes.
+
+    Example:
+
+    >>> box_pairs([0, 0.5, 3], [0, 0.5, 3], [1, 2, 4], [1, 2, 4])
+    (array([0]), array([1]))
+
+    """
+    x_min = asarray(x_min, dtype=float)
+    y_min = asarray(y_min, dtype=float)
+    x_max = asarray(x_max, dtype=float)
+    y_max = asarray(y_max, dtype=float)
+    n = len(x_min)
+    if n < 2:
+        return zeros(0, dtype=int), zeros(0, dtype=int)
+    size = maximum(x_max - x_min, y_max - y_min)
+    h = size[size > 0].min() if (size > 0).any() else 1.0
+    with errstate(divide="ignore"):
+        level = ceil(log2(size / h)).clip(min=0).astype(int)
+    ids = arange(n)
+    first = []
+    second = []
+    for l in unique(level):
+        w = h*2.0**l
+        boxes = ids[level <= l]
+        i0 = floor(x_min[boxes] / w).astype("int64")
+        j0 = floor(y_min[boxes] / w).astype("int64")
+        i1 = floor(x_max[boxes] / w).astype("int64")
+        j1 = floor(y_max[boxes] / w).astype("int64")
+        # the (at most) 2x2 cells of every box
+        box = []
+        ci = []
+        cj = []
+        for di, dj in [(0, 0), (1, 0), (0, 1), (1, 1)]:
+            ok = (i0 + di <= i1) & (j0 + dj <= j1)
+            box.append(boxes[ok])
+            ci.append(i0[ok] + di)
+            cj.append(j0[ok] + dj)
+        box = concatenate(box)
+        ci = concatenate(ci)
+        cj = concatenate(cj)
+        order = lexsort((cj, ci))
+        box, ci, cj = box[order], ci[order], cj[order]
+        new_cell = concatenate([[True], (ci[1:] != ci[:-1]) |
+            (cj[1:] != cj[:-1])])
+        start = nonzero(new_cell)[0]
+        counts = diff(concatenate([start, [len(box)]]))
+        group = cumsum(new_cell) - 1
+        # every box of this level is paired with all the boxes in its cells
+        owner = nonzero(level[box] == l)[0]
+        c = counts[group[owner]]
+        offset = arange(c.sum()) - repeat(cumsum(c) - c, c)
+        first.append(repeat(box[owner], c))
+        second.append(box[repeat(start[group[owner]], c) + offset])
+    p = concatenate(first)
+    q = concatenate(second)
+    lo = minimum(p, q)
+    hi = maximum(p, q)
+    keep = (lo != hi) & (x_min[lo] <= x_max[hi]) & (x_min[hi] <= x_max[lo]) & \
+            (y_min[lo] <= y_max[hi]) & (y_min[hi] <= y_max[lo])
+    keys = unique(lo[keep].astype("int64")*n + hi[keep])
+    return keys // n, keys % n
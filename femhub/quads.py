@@ -0,0 +1,175 @@
+"""
+Conversion of triangular meshes to quad meshes.
+
+merge_to_quads() pairs neighboring triangles into quads (a quad-dominant
+mesh), split_to_quads() splits every element into quads through its edge
+midpoints and its center (an all-quad mesh). Both work on whole arrays.
+"""
+
+from numpy import (array, arange, argsort, concatenate, full, column_stack,
+        unique, nonzero, zeros, arctan2, absolute, pi, minimum, ones)
+
+from refinement import padded_elements, number_edges, split_boundaries
+
+def _as_list(e):
+    """
+    Converts the padded elements back to the list, triangles without -1.
+    """
+    is_quad = e[:, 3] != -1
+    if not is_quad.any():
+        return e[:, :3].tolist()
+    if is_quad.all():
+        return e.tolist()
+    return [el[:3] if el[3] == -1 else el for el in e.tolist()]
+
+def quad_quality(pts, q):
+    """
+    Returns the quality of the (counterclockwise) quads "q" (an (m, 4)
+    array), 1 - max |angle - 90 deg| / 90 deg over the corners.
+
+    It is 1 for rectangles and 0 for degenerate or non-convex quads.
+
+    Example:
+
+    >>> quad_quality(array([[0, 0], [1, 0], [1, 1], [0, 1], [2, 1]]),
+            array([[0, 1, 2, 3], [0, 1, 4, 3]]))
+    array([1. , 0.5])
+
+    """
+    pts = array(pts, dtype=float)
+    p = pts[q]
+    worst = zeros(len(q))
+    convex = ones(len(q), dtype=bool)
+    for k in range(4):
+        u = p[:, (k + 1) % 4] - p[:, k]
+        v = p[:, (k - 1) % 4] - p[:, k]
+        cross = u[:, 0]*v[:, 1] - u[:, 1]*v[:, 0]
+        dot = u[:, 0]*v[:, 0] + u[:, 1]*v[:, 1]
+        convex &= cross > 0
+        angle = arctan2(cross, dot)
+        worst = worst.clip(min=absolute(angle - pi/2))
+    quality = 1 - worst / (pi/2)
+    quality[~convex] = 0
+    return quality
+
+def merge_to_quads(nodes, elements, min_quality=0.5):
+    """
+    Merges pairs of neighboring triangles into quads.
+
+    The candidates are all the interior edges shared by two consistently
+    oriented triangles, scored by quad_quality() of the resulting quad;
+    candidates below "min_quality" are dropped. The pairs are then chosen
+    greedily, the best quad first. This is done in rounds on whole arrays:
+    in every round, all the candidates that are the best remaining ones for
+    both of their triangles are accepted (which gives the same matching as
+    the sequential greedy pass) and the candidates touching the used
+    triangles are removed.
+
+    The quad takes the place of the first triangle of the pair, unpaired
+    triangles and the original quads are kept. Returns the new elements.
+
+    Example:
+
+    >>> merge_to_quads([[0, 0], [1, 0], [1, 1], [0, 1]], [[0, 1, 2], [0, 2, 3]])
+    [[0, 1, 2, 3]]
+
+    """
+    pts = array(nodes, dtype=float).reshape(-1, 2)
+    n = len(pts)
+    e = padded_elements(elements)
+    tri = nonzero(e[:, 3] == -1)[0]
+    if len(tri) < 2:
+        return _as_list(e)
+
+    # directed edges (a, b) of the triangles, with the opposite vertex c
+    t = e[tri, :3]
+    a = t.T.ravel()
+    b = t[:, [1, 2, 0]].T.ravel()
+    c = t[:, [2, 0, 1]].T.ravel()
+    owner = concatenate([tri, tri, tri])
+    keys = minimum(a, b).astype("int64")*n + (a + b - minimum(a, b))
+    order = argsort(keys, kind="mergesort")
+    keys, a, b, c, owner = keys[order], a[order], b[order], c[order], \
+            owner[order]
+    edge_keys, start, counts = unique(keys, return_index=True,
+            return_counts=True)
+    s = start[counts == 2]
+    s = s[a[s] == b[s + 1]]
+    # the quad (a, d, b, c) of the triangles (a, b, c) and (b, a, d)
+    quad = column_stack([a[s], c[s + 1], b[s], c[s]])
+    first = owner[s]
+    second = owner[s + 1]
+    quality = quad_quality(pts, quad)
+    keep = quality >= min_quality
+    quad, first, second, quality = quad[keep], first[keep], second[keep], \
+            quality[keep]
+
+    # greedy matching, rank 0 is the best quad
+    rank = full(len(quality), 0, dtype=int)
+    rank[argsort(-quality, kind="mergesort")] = arange(len(quality))
+    accepted = zeros(len(quality), dtype=bool)
+    alive = arange(len(quality))
+    while len(alive):
+        best = full(len(e), len(quality), dtype=int)
+        minimum.at(best, first[alive], rank[alive])
+        minimum.at(best, second[alive], rank[alive])
+        r = rank[alive]
+        chosen = alive[(best[first[alive]] == r) & (best[second[alive]] == r)]
+        accepted[chosen] = True
+        used = zeros(len(e), dtype=bool)
+        used[first[chosen]] = True
+        used[second[chosen]] = True
+        alive = alive[~used[first[alive]] & ~used[second[alive]]]
+
+    e = e.copy()
+    e[first[accepted]] = quad[accepted]
+    removed = zeros(len(e), dtype=bool)
+    removed[second[accepted]] = True
+    return _as_list(e[~removed])
+
+def split_to_quads(nodes, elements, boundaries):
+    """
+    Splits every element into quads.
+
+    A triangle is split into 3 quads and a quad into 4 quads by connecting
+    its center with the edge midpoints. The new nodes are appended after the
+    old ones (first the edge midpoints, then the element centers) and every
+    boundary edge is split into two at its midpoint.
+
+    Returns the tuple (nodes, elements, boundaries).
+
+    Example:
+
+    >>> nodes, elements, boundaries = split_to_quads([[0, 0], [1, 0], [0, 1]],
+            [[0, 1, 2]], [[0, 1, 1], [1, 2, 2], [2, 0, 3]])
+    >>> elements
+    [[0, 3, 6, 4], [1, 5, 6, 3], [2, 4, 6, 5]]
+
+    """
+    pts = array(nodes, dtype=float).reshape(-1, 2)
+    n = len(pts)
+    e = padded_elements(elements)
+    is_quad = e[:, 3] != -1
+    edge_keys, mid = number_edges(e, n)
+    n_edges = len(edge_keys)
+    center = n + n_edges + arange(len(e))
+    corners = e.copy()
+    corners[~is_quad, 3] = corners[~is_quad, 0]
+    n_vertices = 3 + is_quad
+    centers = pts[corners].sum(axis=1)
+    centers -= pts[corners[:, 3]] * (~is_quad)[:, None]
+    centers /= n_vertices[:, None]
+    new_pts = concatenate([pts, (pts[edge_keys // n] + pts[edge_keys % n]) / 2,
+        centers])
+
+    # the quad at the corner k: (v_k, mid of the edge k, center,
+    # mid of the edge k - 1)
+    children = full((len(e), 4, 4), -1, dtype=int)
+    for k in range(4):
+        prev = (k - 1) % n_vertices
+        children[:, k] = column_stack([e[:, k], mid[:, k], center,
+            mid[arange(len(e)), prev]])
+    children = children.reshape(-1, 4)
+    children = children[children[:, 0] != -1]
+    new_boundaries = split_boundaries(boundaries, edge_keys, n)
+    return new_pts.tolist(), children.tolist(), new_boundaries
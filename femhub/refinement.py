@@ -0,0 +1,205 @@
+"""
+Uniform mesh refinement and nested mesh hierarchies for multigrid.
+
+Every triangle is split into 4 triangles by connecting its edge midpoints,
+every quad into 4 quads through the edge midpoints and its center. The
+children of the element "e" get the numbers 4*e, ..., 4*e + 3, the new nodes
+are appended after the old ones (first the edge midpoints, then the quad
+centers). Everything is done on whole arrays.
+"""
+
+from numpy import (array, arange, concatenate, full, ones, repeat, minimum,
+        maximum, searchsorted, unique, column_stack)
+
+from sparse import CSRMatrix
+from storage import iter_blocks
+
+def padded_elements(elements):
+    """
+    Returns the elements as one (n, 4) array, triangles padded with -1.
+    """
+    blocks = list(iter_blocks(elements, max(len(elements), 1), dtype=int))
+    if not blocks:
+        return full((0, 4), -1, dtype=int)
+    e = blocks[0]
+    if e.shape[1] == 3:
+        e = column_stack([e, full(len(e), -1, dtype=int)])
+    return e
+
+def number_edges(e, n):
+    """
+    Numbers the edges of the elements "e" (padded, see padded_elements()).
+
+    Returns (edge_keys, mid): the sorted keys a*n + b (a < b) of the edges
+    and the (m, 4) array of the edge numbers plus "n" of the element edges
+    (v0, v1), (v1, v2), ..., closing one included (-1 for the missing 4th
+    edge of triangles). So mid[i, k] is the id of the midpoint of the k-th
+    edge if the midpoints are appended after the "n" nodes.
+    """
+    is_quad = e[:, 3] != -1
+    a = e.copy()
+    b = e[:, [1, 2, 3, 0]]
+    b[~is_quad, 2] = e[~is_quad, 0]
+    edge_ok = arange(4)[None, :] < (3 + is_quad)[:, None]
+    lo = minimum(a, b).clip(min=0)
+    hi = maximum(a, b)
+    keys = lo.astype("int64")*n + hi
+    edge_keys, inverse = unique(keys[edge_ok], return_inverse=True)
+    mid = full(e.shape, -1, dtype=int)
+    mid[edge_ok] = n + inverse
+    return edge_keys, mid
+
+def split_boundaries(boundaries, edge_keys, n):
+    """
+    Splits every boundary edge into two at its midpoint (numbered as by
+    number_edges()), both halves keep the marker.
+    """
+    bdy = array([list(b[:3]) for b in boundaries], dtype=int).reshape(-1, 3)
+    if len(bdy) == 0:
+        return []
+    b_keys = bdy[:, :2].min(axis=1).astype("int64")*n + bdy[:, :2].max(axis=1)
+    b_mid = n + searchsorted(edge_keys, b_keys)
+    halves = column_stack([bdy[:, 0], b_mid, bdy[:, 2],
+        b_mid, bdy[:, 1], bdy[:, 2]])
+    return halves.reshape(-1, 3).tolist()
+
+def refine_uniform(nodes, elements, boundaries):
+    """
+    Refines the mesh uniformly.
+
+    Returns a tuple (nodes, elements, boundaries, P), where P is the
+    prolongation (CSRMatrix) of the nodal (piecewise linear or bilinear)
+    values from the coarse to the fine mesh.
+
+    Example:
+
+    >>> nodes, elements, boundaries, P = refine_uniform([[0, 0], [1, 0], [0, 1]],
+            [[0, 1, 2]], [[0, 1, 1], [1, 2, 2], [2, 0, 3]])
+    >>> elements
+    [[0, 3, 4], [3, 1, 5], [4, 5, 2], [3, 5, 4]]
+    >>> boundaries
+    [[0, 3, 1], [3, 1, 1], [1, 5, 2], [5, 2, 2], [2, 4, 3], [4, 0, 3]]
+
+    """
+    pts = array(nodes, dtype=float).reshape(-1, 2)
+    n = len(pts)
+    e = padded_elements(elements)
+    is_quad = e[:, 3] != -1
+    edge_keys, mid = number_edges(e, n)
+    n_edges = len(edge_keys)
+    edge_a = edge_keys // n
+    edge_b = edge_keys % n
+    quads = arange(len(e))[is_quad]
+    center = full(len(e), -1, dtype=int)
+    center[quads] = n + n_edges + arange(len(quads))
+
+    new_pts = concatenate([pts, (pts[edge_a] + pts[edge_b]) / 2,
+        pts[e[quads]].mean(axis=1)])
+
+    # children, 4 per element
+    children = full((len(e), 4, 4), -1, dtype=int)
+    t = ~is_quad
+    children[t, 0, :3] = column_stack([e[t, 0], mid[t, 0], mid[t, 2]])
+    children[t, 1, :3] = column_stack([mid[t, 0], e[t, 1], mid[t, 1]])
+    children[t, 2, :3] = column_stack([mid[t, 2], mid[t, 1], e[t, 2]])
+    children[t, 3, :3] = mid[t, :3]
+    q = is_quad
+    c = center[q]
+    children[q, 0] = column_stack([e[q, 0], mid[q, 0], c, mid[q, 3]])
+    children[q, 1] = column_stack([mid[q, 0], e[q, 1], mid[q, 1], c])
+    children[q, 2] = column_stack([c, mid[q, 1], e[q, 2], mid[q, 2]])
+    children[q, 3] = column_stack([mid[q, 3], c, mid[q, 2], e[q, 3]])
+    children = children.reshape(-1, 4)
+    if not is_quad.any():
+        children = children[:, :3]
+    new_elements = children.tolist()
+    if is_quad.any() and not is_quad.all():
+        new_elements = [ch[:3] if ch[3] == -1 else ch for ch in new_elements]
+
+    new_boundaries = split_boundaries(boundaries, edge_keys, n)
+
+    # prolongation: old nodes are copied, midpoints and centers averaged
+    rows = concatenate([arange(n), repeat(n + arange(n_edges), 2),
+        repeat(center[quads], 4)])
+    cols = concatenate([arange(n), column_stack([edge_a, edge_b]).ravel(),
+        e[quads].ravel()])
+    values = concatenate([ones(n), full(2*n_edges, 0.5),
+        full(4*len(quads), 0.25)])
+    P = CSRMatrix.from_coo(rows, cols, values, (len(new_pts), n))
+    return new_pts.tolist(), new_elements, new_boundaries, P
+
+class MeshHierarchy:
+    """
+    Sequence of nested, uniformly refined meshes.
+
+    meshes[0] is the coarsest mesh, each next one is its uniform refinement.
+    The element "e" of the level "l" has the children 4*e, ..., 4*e + 3 on
+    the level "l + 1" (children(l)), and parents(l + 1) maps the elements
+    back. prolongation(l) interpolates the nodal values from the level "l" to
+    "l + 1", restriction(l) is its transpose. The transfer operators are
+    computed once and cached.
+
+    Example:
+
+    >>> m = Mesh([[0, 0], [1, 0], [0, 1]], [[0, 1, 2]], [[0, 1, 1], [1, 2, 1], [2, 0, 1]])
+    >>> h = m.hierarchy(3)
+    >>> [len(l.elements) for l in h.meshes]
+    [1, 4, 16]
+    >>> h.prolongation(0)
+    <6x3 CSRMatrix with 9 stored entries>
+
+    """
+
+    def __init__(self, mesh, levels):
+        from domain import Mesh
+        if levels < 1:
+            raise ValueError("At least one level is needed.")
+        if len(mesh.curves) != 0:
+            raise NotImplementedError("Refinement of curved meshes is not supported.")
+        self.meshes = [mesh]
+        self._prolongations = []
+        self._restrictions = {}
+        for l in range(levels - 1):
+            m = self.meshes[-1]
+            nodes, elements, boundaries, P = refine_uniform(m.nodes,
+                    m.elements, m.boundaries)
+            self.meshes.append(Mesh(nodes, elements, boundaries))
+            self._prolongations.append(P)
+
+    def __len__(self):
+        return len(self.meshes)
+
+    def __getitem__(self, level):
+        return self.meshes[level]
+
+    def parents(self, level):
+        """
+        Returns the array of the parent elements (on level - 1) of the
+        elements on the given level.
+        """
+        if level < 1 or level >= len(self.meshes):
+            raise IndexError("The level has no parents.")
+        return arange(len(self.meshes[level].elements)) // 4
+
+    def children(self, level):
+        """
+        Returns the (n, 4) array of the children elements (on level + 1) of
+        the elements on the given level.
+        """
+        if level < 0 or level >= len(self.meshes) - 1:
+            raise IndexError("The level has no children.")
+        return arange(4*len(self.meshes[level].elements)).reshape(-1, 4)
+
+    def prolongation(self, level):
+        """
+        Returns the prolongation from the level to level + 1.
+        """
+        return self._prolongations[level]
+
+    def restriction(self, level):
+        """
+        Returns the restriction from the level + 1 to level.
+        """
+        if level not in self._restrictions:
+            self._restrictions[level] = self._prolongations[level].T
+        return self._restrictions[level]
@@ -0,0 +1,538 @@
+"""
+Element size control for graded meshes.
+
+The target element size can be given as a number, as a function of (x, y),
+as values at the domain nodes or computed automatically from the local
+feature size of the boundary. It is sampled into a 2:1 balanced background
+quadtree. The boundary edges are then subdivided by the size along them and
+the interior points are placed on hexagonal lattices with the spacing
+following the size in the leaves of the tree.
+"""
+
+from numpy import (array, asarray, arange, ones, zeros, full, inf, sqrt,
+        minimum, floor, concatenate, repeat, column_stack, interp,
+        cumsum, linspace, unique, argsort, searchsorted, maximum, nonzero,
+        ceil, log2)
+
+from predicates import box_pairs
+from triangulation import points_in_polygon
+
+# maximal ratio of the size change to the distance, when the size is given
+# at the nodes or computed from the local feature size
+GRADING = 0.5
+
+# maximal depth of the background quadtree
+MAX_DEPTH = 12
+
+# minimal distance of the interior points from the boundary, relative to
+# the size
+FAR = 0.6
+
+def distance_to_segments(px, py, radius, ax, ay, bx, by, exclude=None):
+    """
+    Returns the distance of every point to the nearest segment, inf if
+    there is no segment closer than "radius" (a number or one per point).
+
+    The segments are given by the arrays of their end points. Only the
+    segments near the points (with the bounding boxes overlapping the
+    points' boxes of the size "radius", see predicates.box_pairs()) are
+    tested. If "exclude" is given, it is a function
+    exclude(point_ids, segment_ids) returning which of the point/segment
+    pairs to ignore.
+    """
+    px = asarray(px, dtype=float)
+    py = asarray(py, dtype=float)
+    r = asarray(radius, dtype=float) * ones(len(px))
+    d = full(len(px), inf)
+    m = len(px)
+    if m == 0 or len(ax) == 0:
+        return d
+    # the points are placed before the segments
+    p, q = box_pairs(concatenate([px - r, minimum(ax, bx)]),
+            concatenate([py - r, minimum(ay, by)]),
+            concatenate([px + r, maximum(ax, bx)]),
+            concatenate([py + r, maximum(ay, by)]))
+    keep = (p < m) & (q >= m)
+    i, k = p[keep], q[keep] - m
+    if exclude is not None:
+        keep = ~exclude(i, k)
+        i, k = i[keep], k[keep]
+    ux = bx[k] - ax[k]
+    uy = by[k] - ay[k]
+    uu = ux*ux + uy*uy
+    uu[uu == 0] = 1
+    t = (((px[i] - ax[k])*ux + (py[i] - ay[k])*uy) / uu).clip(0, 1)
+    dx = ax[k] + t*ux - px[i]
+    dy = ay[k] + t*uy - py[i]
+    dist = sqrt(dx*dx + dy*dy)
+    dist[dist > r[i]] = inf
+    minimum.at(d, i, dist)
+    return d
+
+def local_feature_size(nodes, edges):
+    """
+    Estimates the local feature size at the boundary nodes.
+
+    It is the minimum of the lengths of the edges at the node and of the
+    distance to the nearest boundary edge not touching the node.
+    """
+    pts = array(nodes, dtype=float)
+    e = array(edges, dtype=int)
+    a = pts[e[:, 0]]
+    b = pts[e[:, 1]]
+    lengths = sqrt(((b - a)**2).sum(axis=1))
+    lfs = full(len(pts), inf)
+    minimum.at(lfs, e[:, 0], lengths)
+    minimum.at(lfs, e[:, 1], lengths)
+    used = lfs < inf
+    def incident(point_ids, edge_ids):
+        return (e[edge_ids, 0] == point_ids) | (e[edge_ids, 1] == point_ids)
+    # only the edges closer than the incident ones matter
+    d = full(len(pts), inf)
+    d[used] = distance_to_segments(pts[used, 0], pts[used, 1], lfs[used],
+            a[:, 0], a[:, 1], b[:, 0], b[:, 1],
+            exclude=lambda i, k: incident(nonzero(used)[0][i], k))
+    return minimum(lfs, d)
+
+def _point_sizes(nodes, edges, size):
+    """
+    Returns the points and the sizes at them for the sizes given at the
+    nodes or "auto" (None for the other size specifications).
+    """
+    if callable(size):
+        return None
+    pts = array(nodes, dtype=float)
+    if isinstance(size, basestring):
+        if size != "auto":
+            raise ValueError("Unknown size specification: %s" % size)
+        used = sorted(set([n for e in edges for n in e]))
+        lfs = local_feature_size(nodes, edges)
+        return pts[used], lfs[used]
+    h = asarray(size, dtype=float)
+    if h.ndim == 0:
+        return None
+    if len(h) != len(nodes):
+        raise ValueError("One size per node is expected.")
+    if (h <= 0).any():
+        raise ValueError("The size must be positive.")
+    return pts, h
+
+def sizing_function(nodes, edges, size="auto"):
+    """
+    Converts the size specification into a function h(x, y) of arrays.
+
+    "size" can be a number, a function of (x, y) (called with NumPy arrays),
+    a sequence of sizes at the domain nodes or "auto" (the local feature
+    size of the boundary). Sizes at the nodes are extended into the domain
+    with the growth rate GRADING (see QuadTree.grade()).
+    """
+    point_sizes = _point_sizes(nodes, edges, size)
+    if point_sizes is not None:
+        tree = size_tree(nodes, edges, size)
+        return tree.value
+    if callable(size):
+        return lambda x, y: asarray(size(x, y), dtype=float) * \
+                ones(len(asarray(x).ravel()))
+    h = asarray(size, dtype=float)
+    if h <= 0:
+        raise ValueError("The size must be positive.")
+    return lambda x, y: full(len(asarray(x).ravel()), float(h))
+
+def size_tree(nodes, edges, size="auto"):
+    """
+    Returns the QuadTree of the element size covering the boundary "edges".
+
+    See sizing_function() for "size".
+    """
+    pts = array(nodes, dtype=float)
+    e = array(edges, dtype=int)
+    used = pts[sorted(set(e.ravel().tolist()))]
+    lo = used.min(axis=0)
+    width = (used.max(axis=0) - lo).max()
+    point_sizes = _point_sizes(nodes, edges, size)
+    if point_sizes is None:
+        return QuadTree(lo[0], lo[1], width, sizing_function(nodes, edges,
+            size))
+    tree = QuadTree(lo[0], lo[1], width)
+    tree.grade(*point_sizes)
+    return tree
+
+class QuadTree:
+    """
+    Balanced background quadtree of the element size.
+
+    The square root cell covering the domain is recursively split while the
+    cell is larger than the target size "h" anywhere in it (sampled in the
+    center and the corners), then cells are split further until the sizes of
+    the neighboring leaves differ at most twice. Leaves are stored as arrays
+    of (level, i, j), the leaf covers
+    [x0 + i*w, x0 + (i+1)*w] x [y0 + j*w, y0 + (j+1)*w], w = width/2**level.
+    Without "h", the tree has just the root, grade() refines it by the sizes
+    given at points.
+
+    Example:
+
+    >>> t = QuadTree(0, 0, 1, lambda x, y: 0.3 + 0*x)
+    >>> len(t.level), t.size(0.5, 0.5)
+    (16, array([ 0.25]))
+
+    """
+
+    def __init__(self, x0, y0, width, h=None, max_depth=MAX_DEPTH):
+        self.x0 = float(x0)
+        self.y0 = float(y0)
+        self.width = float(width)
+        self.max_depth = max_depth
+        self.values = None
+        if h is None:
+            h = lambda x, y: full(len(x), inf)
+        leaves = [[], [], []]
+        level = zeros(1, dtype=int)
+        i = zeros(1, dtype=int)
+        j = zeros(1, dtype=int)
+        while len(level):
+            w = self.width / 2.0**level
+            x = self.x0 + i*w
+            y = self.y0 + j*w
+            target = h(x + w/2, y + w/2)
+            for cx, cy in [(0, 0), (1, 0), (0, 1), (1, 1)]:
+                target = minimum(target, h(x + cx*w, y + cy*w))
+            split = (w > target) & (level < max_depth)
+            for k, a in enumerate([level, i, j]):
+                leaves[k].append(a[~split])
+            level, i, j = self._children(level[split], i[split], j[split])
+        self.level, self.i, self.j = [concatenate(l) for l in leaves]
+        self._balance()
+
+    def _children(self, level, i, j):
+        return (repeat(level + 1, 4),
+                (2*i[:, None] + array([0, 1, 0, 1])).ravel(),
+                (2*j[:, None] + array([0, 0, 1, 1])).ravel())
+
+    def _balance(self):
+        """
+        Splits the leaves until the neighbors differ by at most one level.
+        """
+        while True:
+            # squares that contain a leaf at least 2 levels deeper
+            deep = set()
+            for l, i, j in zip(self.level.tolist(), self.i.tolist(),
+                    self.j.tolist()):
+                for k in range(l - 2, -1, -1):
+                    shift = l - k
+                    key = (k, i >> shift, j >> shift)
+                    if key in deep:
+                        break
+                    deep.add(key)
+            split = zeros(len(self.level), dtype=bool)
+            for n, (l, i, j) in enumerate(zip(self.level.tolist(),
+                    self.i.tolist(), self.j.tolist())):
+                for di, dj in [(-1, 0), (1, 0), (0, -1), (0, 1)]:
+                    if (l, i + di, j + dj) in deep:
+                        split[n] = True
+                        break
+            if not split.any():
+                return
+            level, i, j = self._children(self.level[split], self.i[split],
+                    self.j[split])
+            self.level = concatenate([self.level[~split], level])
+            self.i = concatenate([self.i[~split], i])
+            self.j = concatenate([self.j[~split], j])
+
+    def leaf_widths(self):
+        return self.width / 2.0**self.level
+
+    def leaf_centers(self):
+        w = self.leaf_widths()
+        return self.x0 + (self.i + 0.5)*w, self.y0 + (self.j + 0.5)*w
+
+    def locate(self, x, y):
+        """
+        Returns the indices of the leaves containing the points (x, y), -1
+        for the points outside of the tree.
+        """
+        x = asarray(x, dtype=float).ravel()
+        y = asarray(y, dtype=float).ravel()
+        out = full(len(x), -1, dtype=int)
+        ids = arange(len(self.level))
+        inside = (x >= self.x0) & (x <= self.x0 + self.width) & \
+                (y >= self.y0) & (y <= self.y0 + self.width)
+        for l in unique(self.level):
+            at_level = ids[self.level == l]
+            keys = self.i[at_level].astype("int64") * 2**l + self.j[at_level]
+            order = argsort(keys)
+            keys = keys[order]
+            w = self.width / 2.0**l
+            i = floor((x - self.x0) / w).astype("int64").clip(0, 2**l - 1)
+            j = floor((y - self.y0) / w).astype("int64").clip(0, 2**l - 1)
+            pos = searchsorted(keys, i * 2**l + j).clip(max=len(keys) - 1)
+            found = inside & (keys[pos] == i * 2**l + j)
+            out[found] = at_level[order[pos[found]]]
+        return out
+
+    def size(self, x, y):
+        """
+        Returns the width of the leaves containing the points (x, y).
+        """
+        leaf = self.locate(x, y)
+        out = self.leaf_widths()[leaf]
+        out[leaf == -1] = inf
+        return out
+
+    def value(self, x, y):
+        """
+        Returns the sizes computed by grade() at the points (x, y) (the
+        values of the leaves containing them).
+        """
+        leaf = self.locate(x, y)
+        out = self.values[leaf]
+        out[leaf == -1] = inf
+        return out
+
+    def split(self, mask):
+        """
+        Splits the leaves selected by "mask" and balances the tree.
+        """
+        level, i, j = self._children(self.level[mask], self.i[mask],
+                self.j[mask])
+        self.level = concatenate([self.level[~mask], level])
+        self.i = concatenate([self.i[~mask], i])
+        self.j = concatenate([self.j[~mask], j])
+        self._balance()
+
+    def neighbors(self):
+        """
+        Returns the arrays (a, b) of the pairs of leaves sharing a side (both
+        (a, b) and (b, a) are included).
+        """
+        w = self.leaf_widths()
+        cx, cy = self.leaf_centers()
+        # in a balanced tree, a side has at most 2 neighbors, they contain
+        # the points at 1/4 and 3/4 of the side, w/8 outside of the leaf
+        a = []
+        b = []
+        for dx, dy in [(1, 0), (-1, 0), (0, 1), (0, -1)]:
+            for t in (-0.25, 0.25):
+                px = cx + w*(dx*0.625 + dy*t)
+                py = cy + w*(dy*0.625 + dx*t)
+                leaf = self.locate(px, py)
+                ok = leaf != -1
+                a.append(arange(len(w))[ok])
+                b.append(leaf[ok])
+        a = concatenate(a)
+        b = concatenate(b)
+        n = len(w)
+        keys = unique(concatenate([a.astype("int64")*n + b,
+            b.astype("int64")*n + a]))
+        return keys // n, keys % n
+
+    def grade(self, xy, h, grading=GRADING):
+        """
+        Refines the tree by the sizes "h" given at the points "xy".
+
+        The size at the leaf centers is the Lipschitz extension
+        min_i (h_i + grading*distance to the point i), where the distances
+        are measured along the paths through the centers of the neighboring
+        leaves (so the sizes are slightly larger than with the straight
+        distances). It is computed by relaxation sweeps over all the pairs
+        of neighbors at once. The leaves larger than the size in them are split
+        (starting from the sizes of their parents) until none is. The sizes
+        are stored in "values".
+        """
+        xy = asarray(xy, dtype=float).reshape(-1, 2)
+        h = asarray(h, dtype=float)
+        values = full(len(self.level), inf)
+        while True:
+            w = self.leaf_widths()
+            cx, cy = self.leaf_centers()
+            # the points seed the leaves containing them
+            leaf = self.locate(xy[:, 0], xy[:, 1])
+            ok = leaf != -1
+            seed = h[ok] + grading*sqrt((xy[ok, 0] - cx[leaf[ok]])**2 +
+                    (xy[ok, 1] - cy[leaf[ok]])**2)
+            minimum.at(values, leaf[ok], seed)
+            a, b = self.neighbors()
+            d = grading*sqrt((cx[a] - cx[b])**2 + (cy[a] - cy[b])**2)
+            while True:
+                new = values.copy()
+                minimum.at(new, a, values[b] + d)
+                if (new == values).all():
+                    break
+                values = new
+            # split the leaves larger than the size at the middle of their
+            # sides (it is at least values - grading*w/2)
+            split = (w*(1 + 0.5*grading) > values) & \
+                    (self.level < self.max_depth)
+            if not split.any():
+                break
+            old = (self.level, self.i, self.j, values, cx, cy)
+            self.split(split)
+            # the new leaves start with the size of the old leaf extended
+            # to their centers
+            old_tree = QuadTree(self.x0, self.y0, self.width, None,
+                    self.max_depth)
+            old_tree.level, old_tree.i, old_tree.j = old[:3]
+            ncx, ncy = self.leaf_centers()
+            parent = old_tree.locate(ncx, ncy)
+            values = old[3][parent] + grading*sqrt((ncx - old[4][parent])**2 +
+                    (ncy - old[5][parent])**2)
+        self.values = values
+
+def _lattice_points(tree, h):
+    """
+    Returns the arrays (x, y, spacing, leaf) of the points of hexagonal
+    lattices filling the leaves of the tree.
+
+    The lattice spacing of a leaf is the size "h" at its center rounded
+    down to h_min*2**(k/8), so the spacing follows the size within 10% and
+    the neighboring leaves of similar sizes share the same lattice. Every
+    lattice point belongs to the leaf containing it.
+    """
+    w = tree.leaf_widths()
+    cx, cy = tree.leaf_centers()
+    size = h(cx, cy)
+    k = floor(8*log2(size / size.min()) + 1e-9)
+    s = size.min() * 2**(k/8)
+    dy = s*sqrt(3)/2
+    x = cx - w/2
+    y = cy - w/2
+    # the rows of the lattices in every leaf, every other row is shifted
+    first = ceil((y - tree.y0) / dy).astype(int)
+    n = ceil((y + w - tree.y0) / dy).astype(int) - first
+    leaf = repeat(arange(len(w)), n)
+    row = first[leaf] + arange(n.sum()) - repeat(cumsum(n) - n, n)
+    shift = 0.5*(row % 2)
+    # the points of every row
+    first = ceil((x[leaf] - tree.x0) / s[leaf] - shift).astype(int)
+    n = ceil((x[leaf] + w[leaf] - tree.x0) / s[leaf] - shift).astype(int) - \
+            first
+    r = repeat(arange(len(row)), n)
+    column = first[r] + arange(n.sum()) - repeat(cumsum(n) - n, n)
+    leaf = leaf[r]
+    return (tree.x0 + (column + shift[r])*s[leaf], tree.y0 + row[r]*dy[leaf],
+            s[leaf], leaf)
+
+def _thin(px, py, s):
+    """
+    Returns which points to keep so that no two kept points are closer than
+    0.8 times the smaller of their spacings "s".
+
+    The points with the smaller spacing are preferred. The conflicts are
+    resolved in rounds on whole arrays: the points without a conflict with a
+    better remaining point are kept and their conflicting points removed.
+    """
+    r = 0.4*s
+    p, q = box_pairs(px - r, py - r, px + r, py + r)
+    d = sqrt((px[p] - px[q])**2 + (py[p] - py[q])**2)
+    conflict = d < 0.8*minimum(s[p], s[q])
+    p, q = p[conflict], q[conflict]
+    # rank 0 is the best point
+    rank = zeros(len(px), dtype=int)
+    rank[argsort(s, kind="mergesort")] = arange(len(px))
+    swap = rank[p] > rank[q]
+    p, q = concatenate([p[~swap], q[swap]]), concatenate([q[~swap], p[swap]])
+    keep = ones(len(px), dtype=bool)
+    while len(p):
+        beaten = zeros(len(px), dtype=bool)
+        beaten[q] = True
+        keep[q[~beaten[p]]] = False
+        left = beaten[p] & keep[p] & keep[q]
+        p, q = p[left], q[left]
+    return keep
+
+def grade_domain(nodes, edges, size="auto"):
+    """
+    Adds the points needed for a graded triangulation.
+
+    "edges" are the oriented boundary edges. Every edge is subdivided so
+    that the lengths of the new edges follow the size along it, and the
+    points of hexagonal lattices with the spacing following the size (see
+    _lattice_points()) lying inside the domain and far enough from the
+    boundary are added as interior points. Returns the new (nodes, edges).
+
+    Example:
+
+    >>> nodes = [[0, 0], [1, 0], [1, 1], [0, 1]]
+    >>> edges = [(0, 1), (1, 2), (2, 3), (3, 0)]
+    >>> [len(grade_domain(nodes, edges, s)[0]) for s in (0.1, 0.11, 0.12, 0.13, 0.14)]
+    [125, 103, 88, 84, 70]
+
+    """
+    pts = array(nodes, dtype=float)
+    e = array(edges, dtype=int)
+    tree = size_tree(nodes, edges, size)
+    if tree.values is None:
+        h = sizing_function(nodes, edges, size)
+    else:
+        h = tree.value
+
+    # boundary: equidistribute the integral of 1/size along the edges
+    samples = 16
+    t = linspace(0, 1, samples + 1)
+    a = pts[e[:, 0]]
+    b = pts[e[:, 1]]
+    sx = a[:, 0, None] + t*(b[:, 0] - a[:, 0])[:, None]
+    sy = a[:, 1, None] + t*(b[:, 1] - a[:, 1])[:, None]
+    inv_h = 1 / h(sx.ravel(), sy.ravel()).reshape(sx.shape)
+    lengths = sqrt(((b - a)**2).sum(axis=1))
+    steps = (inv_h[:, 1:] + inv_h[:, :-1]) / 2 * (lengths / samples)[:, None]
+    density = concatenate([zeros((len(e), 1)), cumsum(steps, axis=1)],
+            axis=1)
+    new_nodes = pts.tolist()
+    new_edges = []
+    for k in range(len(e)):
+        n = max(1, int(round(density[k, -1])))
+        # position (0..1) of the split points on the edge
+        s = interp(arange(1, n) * density[k, -1] / n, density[k], t)
+        prev = e[k, 0]
+        for p in (a[k] + s[:, None]*(b[k] - a[k])).tolist():
+            new_nodes.append(p)
+            new_edges.append((prev, len(new_nodes) - 1))
+            prev = len(new_nodes) - 1
+        new_edges.append((prev, e[k, 1]))
+
+    # interior points: lattice points inside the domain, away from the
+    # boundary
+    px, py, s, leaf = _lattice_points(tree, h)
+    far = distance_to_segments(px, py, FAR*s, a[:, 0], a[:, 1], b[:, 0],
+            b[:, 1]) == inf
+    px, py, s, leaf = px[far], py[far], s[far], leaf[far]
+    keep = _thin(px, py, s)
+    px, py, leaf = px[keep], py[keep], leaf[keep]
+    # the leaves not crossed by the boundary are inside or outside as a
+    # whole, and so are the connected groups of them, so only one leaf of
+    # each group is tested; the points in the other leaves are tested
+    # one by one
+    cx, cy = tree.leaf_centers()
+    w = tree.leaf_widths()
+    clear = distance_to_segments(cx, cy, 0.75*w, a[:, 0], a[:, 1], b[:, 0],
+            b[:, 1]) == inf
+    na, nb = tree.neighbors()
+    keep = clear[na] & clear[nb]
+    group = _components(len(w), na[keep], nb[keep])
+    labels, first, index = unique(group[clear], return_index=True,
+            return_inverse=True)
+    ids = nonzero(clear)[0]
+    leaf_inside = zeros(len(w), dtype=bool)
+    leaf_inside[ids] = points_in_polygon(cx[ids[first]], cy[ids[first]],
+            a[:, 0], a[:, 1], b[:, 0], b[:, 1])[index]
+    inside = leaf_inside[leaf]
+    crossed = ~clear[leaf]
+    inside[crossed] = points_in_polygon(px[crossed], py[crossed], a[:, 0],
+            a[:, 1], b[:, 0], b[:, 1])
+    new_nodes.extend(column_stack([px[inside], py[inside]]).tolist())
+    return new_nodes, new_edges
+
+def _components(n, a, b):
+    """
+    Returns the labels of the connected components of the graph with "n"
+    vertices and the edges (a, b) (both directions given).
+    """
+    label = arange(n)
+    while True:
+        new = label.copy()
+        minimum.at(new, a, label[b])
+        new = new[new]
+        if (new == label).all():
+            return label
+        label = new
@@ -0,0 +1,95 @@
+"""
+Minimal sparse matrix in the CSR format, using only NumPy.
+
+It is used for the transfer operators between the mesh levels. If SciPy is
+available, the matrix can be converted with CSRMatrix.to_scipy().
+"""
+
+from numpy import (add, asarray, argsort, bincount, cumsum, concatenate,
+        zeros, diff, repeat, arange)
+
+class CSRMatrix:
+    """
+    Sparse matrix in the compressed sparse row format.
+
+    Row "i" has the column indices indices[indptr[i]:indptr[i+1]] and the
+    values data[indptr[i]:indptr[i+1]].
+
+    Example:
+
+    >>> P = CSRMatrix.from_coo([0, 1, 1], [0, 0, 1], [1.0, 0.5, 0.5], (2, 2))
+    >>> P.dot([2.0, 4.0])
+    array([2., 3.])
+    >>> P.T.dot([1.0, 1.0])
+    array([1.5, 0.5])
+
+    """
+
+    def __init__(self, indptr, indices, data, shape):
+        self.indptr = asarray(indptr, dtype=int)
+        self.indices = asarray(indices, dtype=int)
+        self.data = asarray(data, dtype=float)
+        self.shape = tuple(shape)
+
+    @classmethod
+    def from_coo(cls, rows, cols, values, shape):
+        """
+        Constructs the matrix from the (row, column, value) triplets.
+
+        Duplicate entries are kept (they are summed in dot()).
+        """
+        rows = asarray(rows, dtype=int)
+        order = argsort(rows, kind="mergesort")
+        indptr = concatenate([[0],
+            cumsum(bincount(rows, minlength=shape[0]))])
+        return cls(indptr, asarray(cols, dtype=int)[order],
+                asarray(values, dtype=float)[order], shape)
+
+    def __repr__(self):
+        return "<%dx%d CSRMatrix with %d stored entries>" % (self.shape[0],
+                self.shape[1], len(self.data))
+
+    @property
+    def nnz(self):
+        return len(self.data)
+
+    def row_indices(self):
+        """
+        Returns the row index of every stored entry.
+        """
+        return repeat(arange(self.shape[0]), diff(self.indptr))
+
+    def dot(self, x):
+        """
+        Returns the matrix-vector product.
+        """
+        x = asarray(x, dtype=float)
+        return bincount(self.row_indices(), weights=self.data*x[self.indices],
+                minlength=self.shape[0])
+
+    def transpose(self):
+        """
+        Returns the transposed matrix (also in CSR).
+        """
+        return CSRMatrix.from_coo(self.indices, self.row_indices(),
+                self.data, (self.shape[1], self.shape[0]))
+
+    @property
+    def T(self):
+        return self.transpose()
+
+    def toarray(self):
+        """
+        Returns the dense matrix.
+        """
+        a = zeros(self.shape)
+        add.at(a, (self.row_indices(), self.indices), self.data)
+        return a
+
+    def to_scipy(self):
+        """
+        Returns the scipy.sparse.csr_matrix (SciPy must be installed).
+        """
+        from scipy.sparse import csr_matrix
+        return csr_matrix((self.data, self.indices, self.indptr),
+                shape=self.shape)
@@ -0,0 +1,114 @@
+"""
+Chunked access to the mesh arrays and on-disk mesh storage.
+
+A mesh can be saved into a directory as a set of .npy files (one per array)
+and loaded back memory mapped, so that very large meshes don't have to fit
+into RAM. All the arrays can be processed in blocks of rows using
+iter_blocks(), which works the same for Python lists, NumPy arrays and
+memory mapped arrays.
+"""
+
+import os
+
+from numpy import asarray, full, load
+from numpy.lib.format import open_memmap
+
+CHUNK_SIZE = 100000
+
+_ARRAYS = [("nodes", float, 2), ("elements", int, 3),
+        ("boundaries", int, 3), ("curves", float, 3)]
+
+def row_width(a, default):
+    """
+    Returns the length of the longest row of "a".
+    """
+    shape = getattr(a, "shape", None)
+    if shape is not None and len(shape) == 2:
+        return shape[1]
+    width = 0
+    for row in a:
+        if len(row) > width:
+            width = len(row)
+    if width == 0:
+        width = default
+    return width
+
+def iter_blocks(a, chunk_size=CHUNK_SIZE, dtype=float, fill=-1, width=None):
+    """
+    Iterates over the rows of "a" in 2D arrays of at most "chunk_size" rows.
+
+    "a" can be a list of rows or a (memory mapped) array. Rows shorter than
+    "width" are padded with "fill". By default "width" is the length of the
+    longest row in the block, so for a list the blocks can have different
+    widths (e.g. a block with triangles only in a mesh that also contains
+    quads has 3 columns).
+
+    Example:
+
+    >>> [b.tolist() for b in iter_blocks([[1, 0, 2], [2, 0, 3, 4], [3, 4, 5]], 2, int)]
+    [[[1, 0, 2, -1], [2, 0, 3, 4]], [[3, 4, 5]]]
+    >>> [b.tolist() for b in iter_blocks([[1, 0, 2], [2, 0, 3, 4], [3, 4, 5]], 2, int, width=4)]
+    [[[1, 0, 2, -1], [2, 0, 3, 4]], [[3, 4, 5, -1]]]
+
+    """
+    if chunk_size < 1:
+        raise ValueError("chunk_size must be positive.")
+    for i in range(0, len(a), chunk_size):
+        block = a[i:i+chunk_size]
+        if hasattr(block, "shape"):
+            block = asarray(block, dtype=dtype)
+            if width is not None and block.shape[1] < width:
+                b = full((len(block), width), fill, dtype=dtype)
+                b[:, :block.shape[1]] = block
+                block = b
+            yield block
+            continue
+        w = width
+        if w is None:
+            w = row_width(block, 0)
+        b = full((len(block), w), fill, dtype=dtype)
+        for j, row in enumerate(block):
+            b[j, :len(row)] = row
+        yield b
+
+def save_mesh(path, nodes, elements, boundaries, curves,
+        chunk_size=CHUNK_SIZE):
+    """
+    Saves the mesh arrays into the directory "path" (created if needed).
+
+    Each array is written block by block into its own .npy file, so the mesh
+    is never converted into one big array in memory.
+    """
+    if not os.path.isdir(path):
+        os.makedirs(path)
+    for (name, dtype, default), a in zip(_ARRAYS,
+            [nodes, elements, boundaries, curves]):
+        width = row_width(a, default)
+        out = open_memmap(os.path.join(path, name + ".npy"), mode="w+",
+                dtype=dtype, shape=(len(a), width))
+        i = 0
+        for block in iter_blocks(a, chunk_size, dtype):
+            out[i:i+len(block), :block.shape[1]] = block
+            out[i:i+len(block), block.shape[1]:] = -1
+            i += len(block)
+        out.flush()
+        del out
+
+def load_mesh(path, mmap=True):
+    """
+    Loads the mesh arrays saved by save_mesh().
+
+    Returns a tuple (nodes, elements, boundaries, curves). If "mmap" is True,
+    the nodes, elements and boundaries are memory mapped read-only, so only
+    the blocks that are actually accessed are read from the disk. In a mesh
+    with both triangles and quads, the triangles are padded with -1.
+    """
+    mode = None
+    if mmap:
+        mode = "r"
+    nodes, elements, boundaries, curves = [
+            load(os.path.join(path, name + ".npy"), mmap_mode=mode)
+            for name, dtype, default in _ARRAYS]
+    # curves are few and mix node ids with angles, so keep them as a list
+    curves = [[int(c[0]), int(c[1])] + c[2:].tolist() for c in curves]
+    return nodes, elements, boundaries, curves
@@ -1,6 +1,16 @@
-from numpy import exp, sqrt, array
+from math import sqrt
+
+from numpy import (array, arange, argsort, bincount, cumsum, repeat,
+        nonzero, searchsorted, errstate, full, ones, inf, nan, minimum, maximum,
+        zeros, concatenate, asarray, isfinite)
 from pylab import plot, savefig, grid, legend, clf, pcolor, spy, axis
 
+from predicates import (orientation, angle_criterion, segments_intersect,
+        box_pairs)
+
+# maximal number of (segment, edge) pairs tested at once
+CHUNK_SIZE = 2**20
+
 class TriangulationError(Exception):
     pass
 
@@ -34,26 +44,56 @@ def find_third_point(a, b, pts_list, edges):
     Take a boundary edge (a,b), and in the list of points
     find a point 'c' that lies on the left of ab and maximizes
     the angle acb
+
+    All the points are tested at once (see predicates.py). The candidates
+    are sorted by the angle and only checked for intersections with the
+    edges in growing batches until a valid one is found.
     """
-    found = 0
-    minimum = exp(100)   #this is dirty
-    c_index = -1
-    pt_index = -1
-    for c_point in pts_list:
-        c_index += 1
-        if c_index != a and c_index != b and is_on_the_left(c_index, a, b, pts_list):
-            edge_intersects = \
-                    edge_intersects_edges((a, c_index), pts_list, edges) or \
-                    edge_intersects_edges((b, c_index), pts_list, edges)
-            if not edge_intersects:
-                crit = criterion(a, b, c_index, pts_list)
-                if crit < minimum:
-                    minimum = crit
-                    pt_index = c_index
-                    found = 1
-    if found == 0:
-        raise TriangulationError("ERROR: Optimal point not found in find_third_point().")
-    return pt_index
+    pts = asarray(pts_list, dtype=float)
+    e = array(edges, dtype=int).reshape(-1, 2)
+    c = arange(len(pts))
+    c = c[(c != a) & (c != b)]
+    ax, ay = pts[a]
+    bx, by = pts[b]
+    c = c[orientation(ax, ay, bx, by, pts[c, 0], pts[c, 1]) > 0]
+    crit = angle_criterion(ax, ay, bx, by, pts[c, 0], pts[c, 1])
+    c = c[isfinite(crit)]
+    c = c[argsort(crit[isfinite(crit)], kind="mergesort")]
+    step = 16
+    max_step = max(1, CHUNK_SIZE // max(len(e), 1))
+    for lo, hi in _batches(len(c), step, max_step):
+        batch = c[lo:hi]
+        blocked = _crossing_edges(pts, full(len(batch), a), batch, e).any(axis=1) | \
+                _crossing_edges(pts, full(len(batch), b), batch, e).any(axis=1)
+        ok = nonzero(~blocked)[0]
+        if len(ok):
+            return int(batch[ok[0]])
+    raise TriangulationError("ERROR: Optimal point not found in find_third_point().")
+
+def _batches(n, step, max_step):
+    """
+    Yields the ranges (start, stop) covering range(n), doubling their size
+    from "step" up to "max_step".
+    """
+    start = 0
+    while start < n:
+        yield start, min(n, start + step)
+        start += step
+        step = min(2*step, max_step)
+
+def _crossing_edges(pts, p, q, edges):
+    """
+    Returns the boolean matrix of the segments (p[i], q[i]) crossing the
+    edges[j], ignoring the edges that start at q[i] or end at p[i].
+    """
+    i = edges[:, 0]
+    j = edges[:, 1]
+    hit = segments_intersect(pts[p, 0][:, None], pts[p, 1][:, None],
+            pts[q, 0][:, None], pts[q, 1][:, None],
+            pts[i, 0][None, :], pts[i, 1][None, :],
+            pts[j, 0][None, :], pts[j, 1][None, :])
+    skip = (q[:, None] == i[None, :]) | (p[:, None] == j[None, :])
+    return hit & ~skip
 
 # If the point 'c' belong to a boundary edge, return False,
 # otherwise return True
@@ -73,18 +113,26 @@ def is_boundary_edge(a, b, bdy_edges):
             return True
     return False
 
-def triangulate_af(pts_list, bdy_edges):
+def triangulate_af(pts_list, bdy_edges, progress=None):
     """
     Create a triangulation using the advancing front method.
+
+    If "progress" is given, it is called as progress(elements, front) after
+    each created element, where "elements" is the number of elements created
+    so far and "front" is the current number of front edges. The callback
+    can stop the triangulation by raising an exception.
     """
     # create empty list of elements
     elems = []
     bdy_edges = bdy_edges[:]
+    pts = asarray(pts_list, dtype=float)
     # main loop
     while bdy_edges != []:
+        if progress is not None:
+            progress(len(elems), len(bdy_edges))
         # take the last item from the list of bdy edges (and remove it)
         a,b = bdy_edges.pop()
-        c = find_third_point(a, b, pts_list, bdy_edges)
+        c = find_third_point(a, b, pts, bdy_edges)
         elems.append((a,b,c))
         if is_boundary_edge(c, a, bdy_edges):
             bdy_edges.remove((c,a))
@@ -96,58 +144,178 @@ def triangulate_af(pts_list, bdy_edges):
             bdy_edges.append((c,b))
     return elems
 
+def triangulate_regions(pts_list, bdy_edges, progress=None):
+    """
+    Triangulates each region of the domain independently.
+
+    "bdy_edges" are the oriented boundary edges (see orient_loops()). The
+    "progress" callback is passed to triangulate_af(), with the number of
+    elements counted over all the regions.
+    """
+    elems = []
+    for node_ids, edges in find_regions(pts_list, bdy_edges):
+        local = dict([(n, i) for i, n in enumerate(node_ids)])
+        pts = [pts_list[n] for n in node_ids]
+        edges = [(local[a], local[b]) for a, b in edges]
+        region_progress = None
+        if progress is not None:
+            created = len(elems)
+            region_progress = lambda n, front: progress(created + n, front)
+        for e in triangulate_af(pts, edges, region_progress):
+            elems.append(tuple([node_ids[i] for i in e]))
+    return elems
+
 # Plot triangular mesh
 def plot_tria_mesh(pts_list, tria_mesh):
+    from storage import iter_blocks
     clf()
-    label=""
-    for elem in tria_mesh:
-        a,b,c = elem
-        ax,ay = pts_list[a]
-        bx,by = pts_list[b]
-        cx,cy = pts_list[c]
-        x_array = array([ax,bx,cx,ax])
-        y_array = array([ay,by,cy,ay])
-        plot(x_array, y_array, "g-")
+    pts = asarray(pts_list, dtype=float)
+    for block in iter_blocks(tria_mesh, dtype=int):
+        # closed outline of each element, separated by NaNs, so that every
+        # block is drawn with a single plot() call
+        # (quads are drawn too, padded triangles just repeat their first node)
+        outline = concatenate([block, block[:, :1]], axis=1)
+        padded = outline == -1
+        outline[padded] = repeat(block[:, :1], outline.shape[1], axis=1)[padded]
+        x = full((len(block), outline.shape[1] + 1), nan)
+        y = full((len(block), outline.shape[1] + 1), nan)
+        x[:, :-1] = pts[outline, 0]
+        y[:, :-1] = pts[outline, 1]
+        plot(x.ravel(), y.ravel(), "g-")
     axis("equal")
     savefig("a.png")
 
 def convert_graph(vertices, edges):
-    pts_list = []
-    _edges = []
-    for i in range(len(vertices)):
-        pts_list.append(vertices[i])
-        for n in edges[i]:
-            if n > i:
-                _edges.append((i, n))
+    n = len(vertices)
+    pts_list = [vertices[i] for i in range(n)]
+    _edges = [(i, j) for i in range(n) for j in edges[i] if j > i]
     return pts_list, _edges
 
 def polygon_area(nodes, edges):
     """
     Calculates the (oriented) area of the polygon.
 
-    It ignores any possible holes in the polygon.
+    The edges are expected to form one closed loop. If they form several
+    loops, the oriented areas of all of them are summed up.
+
+    Example:
+
+    >>> polygon_area([[0, 0], [2, 0], [2, 1], [0, 1]], [(0, 1), (1, 2), (2, 3), (3, 0)])
+    2.0
+
     """
-    # extract the (x, y) coordinates of the boundary nodes in the order
-    x = []
-    y = []
-    for e in edges:
-        n = nodes[e[0]]
-        x.append(n[0])
-        y.append(n[1])
-        n = nodes[e[1]]
-        x.append(n[0])
-        y.append(n[1])
-    # "close" the polygon
-    x.append(x[0])
-    x.append(x[1])
-    y.append(y[0])
-    y.append(y[1])
-    # compute the area
-    a = 0.0
-    for i in range(1, len(x)-1):
-        a += x[i] * (y[i+1] - y[i-1])
-    a /= 2;
-    return a
+    if len(edges) == 0:
+        return 0.0
+    pts = array(nodes, dtype=float)
+    edges = array(edges, dtype=int)
+    x0 = pts[edges[:, 0], 0]
+    y0 = pts[edges[:, 0], 1]
+    x1 = pts[edges[:, 1], 0]
+    y1 = pts[edges[:, 1], 1]
+    return float((x0*y1 - x1*y0).sum()) / 2
+
+def points_in_polygon(px, py, x0, y0, x1, y1, chunk_size=2**20):
+    """
+    Returns a boolean array telling which points lie inside the polygon.
+
+    The points are given by the coordinate arrays "px", "py", the polygon by
+    the coordinate arrays of its edges (x0, y0) -> (x1, y1). The polygon can
+    consist of several loops (e.g. a region with holes), the even-odd
+    (crossing number) rule is used. Points are processed in blocks so that at
+    most "chunk_size" point/edge pairs are held in memory at once.
+    """
+    inside = zeros(len(px), dtype=bool)
+    if len(px) == 0 or len(x0) == 0:
+        return inside
+    step = max(1, chunk_size // len(x0))
+    dy = y1 - y0
+    for i in range(0, len(px), step):
+        x = px[i:i+step, None]
+        y = py[i:i+step, None]
+        crosses = (y0 > y) != (y1 > y)
+        with errstate(divide="ignore", invalid="ignore"):
+            x_cross = x0 + (y - y0) * (x1 - x0) / dy
+        inside[i:i+step] = ((crosses & (x < x_cross)).sum(axis=1) % 2) == 1
+    return inside
+
+def loop_hierarchy(nodes, loops):
+    """
+    Finds out how the loops are nested in each other.
+
+    Returns a tuple (areas, parents, depths), where areas[i] is the oriented
+    area of the i-th loop, parents[i] is the index of the smallest loop that
+    contains the i-th loop (-1 if there is none) and depths[i] is the number
+    of loops containing the i-th loop. Loops with an even depth bound a
+    region from the outside, loops with an odd depth are holes.
+
+    The loops must not intersect each other. Only loops whose bounding box
+    fits into the bounding box of a bigger loop are tested for containment,
+    so many small holes are processed in nearly linear time.
+
+    Example:
+
+    >>> nodes = [[0, 0], [3, 0], [3, 3], [0, 3], [1, 1], [2, 1], [2, 2], [1, 2]]
+    >>> loop_hierarchy(nodes, [[(0, 1), (1, 2), (2, 3), (3, 0)],
+            [(4, 5), (5, 6), (6, 7), (7, 4)]])
+    ([9.0, 1.0], [-1, 0], [0, 1])
+
+    """
+    n = len(loops)
+    if n == 0:
+        return [], [], []
+    pts = array(nodes, dtype=float)
+    lens = array([len(loop) for loop in loops], dtype=int)
+    starts = cumsum(lens) - lens
+    edges = array([e for loop in loops for e in loop], dtype=int)
+    owner = repeat(arange(n), lens)
+    x0 = pts[edges[:, 0], 0]
+    y0 = pts[edges[:, 0], 1]
+    x1 = pts[edges[:, 1], 0]
+    y1 = pts[edges[:, 1], 1]
+    areas = bincount(owner, weights=x0*y1 - x1*y0, minlength=n) / 2
+    abs_areas = abs(areas)
+    x_min = full(n, inf)
+    y_min = full(n, inf)
+    x_max = full(n, -inf)
+    y_max = full(n, -inf)
+    minimum.at(x_min, owner, x0)
+    minimum.at(y_min, owner, y0)
+    maximum.at(x_max, owner, x0)
+    maximum.at(y_max, owner, y0)
+    # any node of a loop can represent it, as the loops don't intersect
+    rx = x0[starts]
+    ry = y0[starts]
+
+    # loops sorted by the left side of their bounding box, so that the
+    # candidates that can fit into a given loop form a contiguous range
+    by_x = argsort(x_min, kind="mergesort")
+    x_min_sorted = x_min[by_x]
+    parents = -ones(n, dtype=int)
+    parent_areas = full(n, inf)
+    for j in range(n):
+        lo = searchsorted(x_min_sorted, x_min[j], side="left")
+        hi = searchsorted(x_min_sorted, x_max[j], side="right")
+        cand = by_x[lo:hi]
+        cand = cand[(abs_areas[cand] < abs_areas[j]) &
+                (x_max[cand] <= x_max[j]) &
+                (y_min[cand] >= y_min[j]) & (y_max[cand] <= y_max[j])]
+        if len(cand) == 0:
+            continue
+        s, e = starts[j], starts[j] + lens[j]
+        cand = cand[points_in_polygon(rx[cand], ry[cand],
+            x0[s:e], y0[s:e], x1[s:e], y1[s:e])]
+        # keep the smallest loop containing the candidate
+        cand = cand[abs_areas[j] < parent_areas[cand]]
+        parents[cand] = j
+        parent_areas[cand] = abs_areas[j]
+
+    # parents are bigger than their children, so going from the biggest loop
+    # the depth of the parent is always known
+    depths = zeros(n, dtype=int)
+    for i in argsort(-abs_areas, kind="mergesort"):
+        if parents[i] != -1:
+            depths[i] = depths[parents[i]] + 1
+    return areas.tolist(), parents.tolist(), depths.tolist()
 
 def edges_flip_orientation(edges):
     """
@@ -200,15 +368,13 @@ def check_regularity(edges):
 
     Otherwise it raises the proper exception.
     """
+    counter = {}
+    for a, b in edges:
+        counter[a] = counter.get(a, 0) + 1
+        counter[b] = counter.get(b, 0) + 1
     for a, b in edges:
-        counter_a = 0
-        counter_b = 0
-        for x, y in edges:
-            if a == x or a == y:
-                counter_a += 1
-            if b == x or b == y:
-                counter_b += 1
-        assert (counter_a > 0) and (counter_b > 0)
+        counter_a = counter[a]
+        counter_b = counter[b]
         if (counter_a == 1) or (counter_b == 1):
             raise Exception("Boundary is not closed.")
         if (counter_a > 2) or (counter_b > 2):
@@ -222,64 +388,114 @@ def find_loops(edges):
     something goes wrong.
     """
     check_regularity(edges)
+    # edges incident to each node
+    incident = {}
+    for i, (a, b) in enumerate(edges):
+        incident.setdefault(a, []).append(i)
+        incident.setdefault(b, []).append(i)
+    used = [False] * len(edges)
     loops = []
-    edges = edges[:]
-    start_i = -1
-    last_i = -1
-    n = []
-    while edges != []:
-        if start_i == -1:
-            e = edges[0]
-            n = [e]
-            del edges[0]
-            start_i = n[-1][0]
-            last_i = n[-1][1]
-        else:
-            ok = False
-            for i, e in enumerate(edges):
-                if e[0] == last_i:
-                    n.append(e)
-                    del edges[i]
-                    ok = True
-                    break
-                elif e[1] == last_i:
-                    n.append((e[1], e[0]))
-                    del edges[i]
-                    ok = True
+    for first in range(len(edges)):
+        if used[first]:
+            continue
+        used[first] = True
+        e = tuple(edges[first])
+        n = [e]
+        start_i, last_i = e
+        while True:
+            # every node has exactly two edges, find the unused one
+            next_i = None
+            for i in incident[last_i]:
+                if not used[i]:
+                    next_i = i
                     break
-            if not ok:
-                if start_i == last_i:
-                    start_i = -1
-                    loops.append(n)
-                else:
-                    raise Exception("Missing some boundary edge")
+            if next_i is None:
+                break
+            used[next_i] = True
+            a, b = edges[next_i]
+            if a == last_i:
+                n.append((a, b))
+            else:
+                n.append((b, a))
             last_i = n[-1][1]
-    if start_i == last_i:
+        if start_i != last_i:
+            raise Exception("Missing some boundary edge")
         loops.append(n)
-    else:
-        raise Exception("Missing some boundary edge")
     return loops
 
 def orient_loops(nodes, loops):
+    """
+    Orients the loops and returns all their edges in one list.
+
+    Loops bounding a region from the outside are oriented counterclockwise,
+    holes clockwise (islands inside holes are again counterclockwise, and so
+    on). The loops are returned from the largest to the smallest one.
+
+    Example:
+
+    >>> nodes = [[0, 0], [3, 0], [3, 3], [0, 3], [1, 1], [2, 1], [2, 2], [1, 2]]
+    >>> orient_loops(nodes, [[(4, 5), (5, 6), (6, 7), (7, 4)],
+            [(0, 3), (3, 2), (2, 1), (1, 0)]])
+    [(0, 1), (1, 2), (2, 3), (3, 0), (4, 7), (7, 6), (6, 5), (5, 4)]
+
+    """
+    areas, parents, depths = loop_hierarchy(nodes, loops)
     n = []
-    area_loop_list = []
-    for loop in loops:
-        area_loop_list.append((polygon_area(nodes, loop), loop))
-    area_loop_list.sort(key=lambda x: abs(x[0]))
-    area_loop_list.reverse()
-    first = True
-    for area, loop in area_loop_list:
-        if first:
-            flip = polygon_area(nodes, loop) < 0
+    for i in sorted(range(len(loops)), key=lambda i: abs(areas[i]),
+            reverse=True):
+        if depths[i] % 2 == 0:
+            flip = areas[i] < 0
         else:
-            flip = polygon_area(nodes, loop) > 0
+            flip = areas[i] > 0
         if flip:
-            n.extend(edges_flip_orientation(loop))
+            n.extend(edges_flip_orientation(loops[i]))
         else:
-            n.extend(loop)
-        first = False
+            n.extend(loops[i])
     return n
 
+def find_regions(nodes, edges):
+    """
+    Splits the domain into its disjoint regions.
+
+    "edges" are the oriented boundary edges (as returned by orient_loops()).
+    Returns a list of (node_ids, region_edges) tuples, one per region, where
+    "region_edges" are the outer loop of the region followed by its holes and
+    "node_ids" are the sorted ids of the region boundary nodes together with
+    any nodes (not lying on the boundary) inside the region.
+
+    Example:
+
+    >>> nodes = [[0, 0], [1, 0], [1, 1], [0, 1], [2, 0], [3, 0], [3, 1], [2, 1]]
+    >>> find_regions(nodes, [(0, 1), (1, 2), (2, 3), (3, 0),
+            (4, 5), (5, 6), (6, 7), (7, 4)])
+    [([0, 1, 2, 3], [(0, 1), (1, 2), (2, 3), (3, 0)]), ([4, 5, 6, 7], [(4, 5), (5, 6), (6, 7), (7, 4)])]
+
+    """
+    if len(edges) == 0:
+        return []
+    loops = find_loops(edges)
+    areas, parents, depths = loop_hierarchy(nodes, loops)
+    outer = [i for i in range(len(loops)) if depths[i] % 2 == 0]
+    region_edges = dict([(i, list(loops[i])) for i in outer])
+    for i in range(len(loops)):
+        if depths[i] % 2 == 1:
+            region_edges[parents[i]].extend(loops[i])
+    bdy_nodes = set([a for a, b in edges])
+    free = array([i for i in range(len(nodes)) if i not in bdy_nodes],
+            dtype=int)
+    pts = array(nodes, dtype=float)
+    regions = []
+    for i in outer:
+        r_edges = region_edges[i]
+        node_ids = set([a for a, b in r_edges])
+        if len(free) > 0:
+            e = array(r_edges, dtype=int)
+            inside = points_in_polygon(pts[free, 0], pts[free, 1],
+                    pts[e[:, 0], 0], pts[e[:, 0], 1],
+                    pts[e[:, 1], 0], pts[e[:, 1], 1])
+            node_ids.update(free[inside].tolist())
+        regions.append((sorted(node_ids), r_edges))
+    return regions
 
 def ccw(A, B, C):
     return (C[1]-A[1])*(B[0]-A[0]) > (B[1]-A[1])*(C[0]-A[0])
@@ -302,25 +518,32 @@ def two_edges_intersect(nodes, e1, e2):
 def any_edges_intersect(nodes, edges):
     """
     Returns True if any two edges intersect.
+
+    Only the pairs of edges with overlapping bounding boxes (see
+    predicates.box_pairs()) are tested.
     """
-    for i in range(len(edges)):
-        for j in range(i+1, len(edges)):
-            e1 = edges[i]
-            e2 = edges[j]
-            if e1[1] == e2[0] or e1[0] == e2[1]:
-                continue
-            if two_edges_intersect(nodes, e1, e2):
-                return True
+    pts = asarray(nodes, dtype=float)
+    e = array(edges, dtype=int).reshape(-1, 2)
+    a = pts[e[:, 0]]
+    b = pts[e[:, 1]]
+    p, q = box_pairs(minimum(a[:, 0], b[:, 0]), minimum(a[:, 1], b[:, 1]),
+            maximum(a[:, 0], b[:, 0]), maximum(a[:, 1], b[:, 1]))
+    keep = (e[p, 1] != e[q, 0]) & (e[p, 0] != e[q, 1])
+    p, q = p[keep], q[keep]
+    for start in range(0, len(p), CHUNK_SIZE):
+        i = p[start:start+CHUNK_SIZE]
+        j = q[start:start+CHUNK_SIZE]
+        if segments_intersect(a[i, 0], a[i, 1], b[i, 0], b[i, 1],
+                a[j, 0], a[j, 1], b[j, 0], b[j, 1]).any():
+            return True
     return False
 
 def edge_intersects_edges(e1, nodes, edges):
     """
     Returns True if "e1" intersects any edge from "edges".
     """
-    for i in range(len(edges)):
-        e2 = edges[i]
-        if e1[1] == e2[0] or e1[0] == e2[1]:
-            continue
-        if two_edges_intersect(nodes, e1, e2):
-            return True
-    return False
+    if len(edges) == 0:
+        return False
+    pts = asarray(nodes, dtype=float)
+    e = array(edges, dtype=int).reshape(-1, 2)
+    return bool(_crossing_edges(pts, array([e1[0]]), array([e1[1]]), e).any())
@@ -0,0 +1,229 @@
+"""
+Validity checks of meshes.
+
+All the checks work on whole arrays: the element edges are sorted once into
+an edge table (O(M log M)), overlapping elements and hanging nodes are only
+tested for the candidates with overlapping bounding boxes, found in a
+hierarchy of grids matching the box sizes (predicates.box_pairs()), so
+graded meshes are checked as fast as uniform ones.
+"""
+
+from numpy import (array, arange, argsort, bincount, concatenate, full,
+        nonzero, sqrt, unique, zeros, in1d, maximum, minimum, ones, absolute)
+
+from predicates import box_pairs
+from storage import iter_blocks
+
+# relative tolerance of the geometric tests (with respect to the element
+# or edge size)
+TOLERANCE = 1e-10
+
+class MeshValidation:
+    """
+    Result of Mesh.validate().
+
+    The attributes list the problems found (all empty for a valid mesh):
+
+    inverted ........... elements with a negative (clockwise) orientation
+    degenerate ......... elements with a zero area
+    non_manifold ....... ((a, b), [elements]) for edges of 3 or more elements
+    misoriented ........ (e1, e2) neighbors with inconsistent orientation
+    overlapping ........ (e1, e2) elements whose interiors overlap
+    hanging_nodes ...... (node, element), node lying inside an element edge
+    missing_boundaries . (a, b) edges of one element missing in boundaries
+    extra_boundaries ... indices of boundaries that are not boundary edges
+
+    Example:
+
+    >>> v = MeshValidation()
+    >>> v.valid
+    True
+    >>> print v
+    Mesh is valid.
+
+    """
+
+    _fields = ["inverted", "degenerate", "non_manifold", "misoriented",
+            "overlapping", "hanging_nodes", "missing_boundaries",
+            "extra_boundaries"]
+
+    def __init__(self):
+        for name in self._fields:
+            setattr(self, name, [])
+
+    @property
+    def valid(self):
+        for name in self._fields:
+            if getattr(self, name):
+                return False
+        return True
+
+    def __nonzero__(self):
+        return self.valid
+
+    def __str__(self):
+        if self.valid:
+            return "Mesh is valid."
+        lines = ["Mesh is not valid:"]
+        for name in self._fields:
+            problems = getattr(self, name)
+            if problems:
+                lines.append("    %s (%d): %s" % (name, len(problems),
+                    problems[:10]))
+        return "\n".join(lines)
+
+def _element_array(elements):
+    blocks = list(iter_blocks(elements, max(len(elements), 1), dtype=int))
+    if not blocks:
+        return zeros((0, 3), dtype=int)
+    return blocks[0]
+
+def _element_edges(e):
+    """
+    Returns the directed edges (a, b, element) of all the elements.
+    """
+    width = e.shape[1]
+    n_vertices = full(len(e), width)
+    if width == 4:
+        n_vertices[e[:, 3] == -1] = 3
+    a = []
+    b = []
+    owner = []
+    ids = arange(len(e))
+    for k in range(width):
+        has = n_vertices > k
+        nxt = (k + 1) % n_vertices[has]
+        a.append(e[has, k])
+        b.append(e[has][arange(has.sum()), nxt])
+        owner.append(ids[has])
+    return concatenate(a), concatenate(b), concatenate(owner)
+
+def _signed_areas(pts, e):
+    """
+    Returns the signed areas of the elements (shoelace formula).
+    """
+    a, b, owner = _element_edges(e)
+    cross = pts[a, 0]*pts[b, 1] - pts[b, 0]*pts[a, 1]
+    return bincount(owner, weights=cross, minlength=len(e)) / 2
+
+def _overlapping(pts, e, pairs_a, pairs_b, eps):
+    """
+    Returns which pairs of (convex) elements overlap, using the separating
+    axis test. "eps" is the tolerance of every pair.
+    """
+    width = e.shape[1]
+    # close the padded triangles by repeating their first node
+    corners = e.copy()
+    if width == 4:
+        tri = corners[:, 3] == -1
+        corners[tri, 3] = corners[tri, 0]
+    overlap = ones(len(pairs_a), dtype=bool)
+    pa = pts[corners[pairs_a]]
+    pb = pts[corners[pairs_b]]
+    for poly in (pa, pb):
+        for k in range(width):
+            d = poly[:, (k + 1) % width] - poly[:, k]
+            nx = -d[:, 1]
+            ny = d[:, 0]
+            length = sqrt(nx*nx + ny*ny)
+            axis_ok = length > 0
+            length[~axis_ok] = 1
+            nx = nx / length
+            ny = ny / length
+            proj_a = pa[:, :, 0]*nx[:, None] + pa[:, :, 1]*ny[:, None]
+            proj_b = pb[:, :, 0]*nx[:, None] + pb[:, :, 1]*ny[:, None]
+            separated = (proj_a.max(axis=1) <= proj_b.min(axis=1) + eps) | \
+                    (proj_b.max(axis=1) <= proj_a.min(axis=1) + eps)
+            overlap &= ~(separated & axis_ok)
+    return overlap
+
+def validate_mesh(nodes, elements, boundaries):
+    """
+    Checks that the mesh is conforming and consistent with its boundaries.
+
+    Returns a MeshValidation.
+    """
+    result = MeshValidation()
+    pts = array(nodes, dtype=float).reshape(-1, 2)
+    e = _element_array(elements)
+    n = len(pts)
+    if len(e) == 0:
+        return result
+
+    # orientation, an element is degenerate if its area is tiny compared
+    # to its longest edge
+    areas = _signed_areas(pts, e)
+    a, b, owner = _element_edges(e)
+    longest = zeros(len(e))
+    maximum.at(longest, owner, ((pts[b] - pts[a])**2).sum(axis=1))
+    degenerate = absolute(areas) <= TOLERANCE*longest
+    result.degenerate = nonzero(degenerate)[0].tolist()
+    result.inverted = nonzero((areas < 0) & ~degenerate)[0].tolist()
+
+    # edge table
+    lo = minimum(a, b).astype("int64")
+    hi = maximum(a, b).astype("int64")
+    keys = lo*n + hi
+    order = argsort(keys, kind="mergesort")
+    keys, a, b, owner = keys[order], a[order], b[order], owner[order]
+    edge_keys, start, counts = unique(keys, return_index=True,
+            return_counts=True)
+    for s, c in zip(start[counts > 2], counts[counts > 2]):
+        k = keys[s]
+        result.non_manifold.append(((int(k // n), int(k % n)),
+            owner[s:s+c].tolist()))
+    two = start[counts == 2]
+    same_direction = a[two] == a[two + 1]
+    result.misoriented = zip(owner[two][same_direction].tolist(),
+            owner[two + 1][same_direction].tolist())
+
+    # boundaries: the edges of exactly one element
+    free = start[counts == 1]
+    bdy = array([list(x[:2]) for x in boundaries], dtype="int64").reshape(-1, 2)
+    bdy_keys = minimum(bdy[:, 0], bdy[:, 1])*n + maximum(bdy[:, 0], bdy[:, 1])
+    missing = free[~in1d(keys[free], bdy_keys)]
+    result.missing_boundaries = zip(a[missing].tolist(), b[missing].tolist())
+    result.extra_boundaries = nonzero(~in1d(bdy_keys, keys[free]))[0].tolist()
+
+    # hanging nodes lie inside a free edge (the element on the other side
+    # has the node as its vertex, so its edges are free too)
+    if len(free):
+        fa, fb, fo = a[free], b[free], owner[free]
+        cand = unique(concatenate([fa, fb]))
+        x_min = minimum(pts[fa, 0], pts[fb, 0])
+        y_min = minimum(pts[fa, 1], pts[fb, 1])
+        x_max = maximum(pts[fa, 0], pts[fb, 0])
+        y_max = maximum(pts[fa, 1], pts[fb, 1])
+        # the nodes are boxes of zero size, placed after the edges
+        m = len(free)
+        p, q = box_pairs(concatenate([x_min, pts[cand, 0]]),
+                concatenate([y_min, pts[cand, 1]]),
+                concatenate([x_max, pts[cand, 0]]),
+                concatenate([y_max, pts[cand, 1]]))
+        keep = (p < m) & (q >= m)
+        edge, node = p[keep], cand[q[keep] - m]
+        keep = (node != fa[edge]) & (node != fb[edge])
+        edge, node = edge[keep], node[keep]
+        d = pts[fb[edge]] - pts[fa[edge]]
+        r = pts[node] - pts[fa[edge]]
+        dd = (d*d).sum(axis=1)
+        t = (r*d).sum(axis=1) / dd
+        dist = absolute(d[:, 0]*r[:, 1] - d[:, 1]*r[:, 0]) / sqrt(dd)
+        on_edge = (dist <= TOLERANCE*sqrt(dd)) & (t > TOLERANCE) & (t < 1 - TOLERANCE)
+        result.hanging_nodes = zip(node[on_edge].tolist(),
+                fo[edge[on_edge]].tolist())
+
+    # overlapping elements among the candidates sharing a grid cell
+    corners = e.copy()
+    if e.shape[1] == 4:
+        corners[corners[:, 3] == -1, 3] = corners[corners[:, 3] == -1, 0]
+    ex = pts[corners, 0]
+    ey = pts[corners, 1]
+    p, q = box_pairs(ex.min(axis=1), ey.min(axis=1), ex.max(axis=1),
+            ey.max(axis=1))
+    if len(p):
+        # the touching elements are not overlapping, up to the tolerance
+        eps = TOLERANCE*sqrt(minimum(longest[p], longest[q]))
+        overlap = _overlapping(pts, e, p, q, eps)
+        result.overlapping = zip(p[overlap].tolist(), q[overlap].tolist())
+    return result
@@ -0,0 +1,163 @@
+"""
+Merging of coincident nodes and gluing of meshes.
+
+The nodes are hashed into square cells of the size of the tolerance, so
+every node is only compared with the nodes in the 3x3 neighboring cells and
+the merging runs in linear time.
+"""
+
+from numpy import array, floor, unique, concatenate, sort
+
+from storage import iter_blocks
+
+def find_duplicate_nodes(nodes, tol):
+    """
+    Returns (representative, n) where representative[i] is the new id of the
+    node "i" and "n" is the number of distinct nodes.
+
+    Nodes closer than "tol" to an already seen node get its id. The distinct
+    nodes keep their original order.
+
+    Example:
+
+    >>> find_duplicate_nodes([[0, 0], [1, 0], [1e-12, 0], [1, 1]], 1e-9)
+    ([0, 1, 0, 2], 3)
+
+    """
+    if tol <= 0:
+        raise ValueError("The tolerance must be positive.")
+    pts = array(nodes, dtype=float).reshape(-1, 2)
+    cells = floor(pts / tol).astype("int64").tolist()
+    xy = pts.tolist()
+    tol2 = tol*tol
+    grid = {}
+    representative = []
+    n = 0
+    for k in range(len(xy)):
+        x, y = xy[k]
+        ci, cj = cells[k]
+        found = -1
+        for di in (-1, 0, 1):
+            for dj in (-1, 0, 1):
+                for other in grid.get((ci + di, cj + dj), ()):
+                    ox, oy = xy[other]
+                    if (ox - x)**2 + (oy - y)**2 <= tol2:
+                        found = other
+                        break
+                if found != -1:
+                    break
+            if found != -1:
+                break
+        if found == -1:
+            grid.setdefault((ci, cj), []).append(k)
+            representative.append(n)
+            n += 1
+        else:
+            representative.append(representative[found])
+    return representative, n
+
+def _interior_edge_keys(elements, n):
+    """
+    Returns the sorted keys (a*n + b, a < b) of the edges shared by at least
+    two elements.
+    """
+    keys = []
+    for block in iter_blocks(elements, dtype=int):
+        width = block.shape[1]
+        for k in range(width):
+            a = block[:, k]
+            b = block[:, (k + 1) % width].copy()
+            if width == 4:
+                # the closing edge of the padded triangles
+                tri = block[:, 3] == -1
+                if k == 2:
+                    b[tri] = block[tri, 0]
+                elif k == 3:
+                    a = a[~tri]
+                    b = b[~tri]
+            lo = sort(array([a, b]), axis=0)
+            keys.append(lo[0].astype("int64")*n + lo[1])
+    if not keys:
+        return array([], dtype="int64")
+    edge_keys, counts = unique(concatenate(keys), return_counts=True)
+    return edge_keys[counts > 1]
+
+def merge_duplicate_nodes(nodes, elements, boundaries, curves, tol):
+    """
+    Merges the nodes closer than "tol" and renumbers the mesh.
+
+    Elements that become degenerate are dropped (quads with two merged nodes
+    become triangles), as well as the boundaries and curves collapsed to a
+    point. Elements and boundary edges that become duplicates of previous
+    ones (e.g. in the overlapping strip of two glued meshes) are dropped
+    too. Boundary edges that become shared by two elements (e.g. the
+    interface of two glued meshes) are no longer boundaries and are removed.
+
+    Returns the tuple (nodes, elements, boundaries, curves).
+
+    Example:
+
+    >>> nodes = [[0, 0], [1, 0], [0, 1], [0, 0], [1, 0], [0, 1]]
+    >>> boundaries = [[0, 1, 1], [1, 2, 1], [2, 0, 1], [3, 4, 1], [4, 5, 1], [5, 3, 1]]
+    >>> merge_duplicate_nodes(nodes, [[0, 1, 2], [3, 4, 5]], boundaries, [], 1e-10)
+    ([[0.0, 0.0], [1.0, 0.0], [0.0, 1.0]], [[0, 1, 2]], [[0, 1, 1], [1, 2, 1], [2, 0, 1]], [])
+
+    """
+    representative, n = find_duplicate_nodes(nodes, tol)
+    pts = array(nodes, dtype=float).reshape(-1, 2).tolist()
+    new_nodes = [None] * n
+    for k, r in enumerate(representative):
+        if new_nodes[r] is None:
+            new_nodes[r] = pts[k]
+
+    new_elements = []
+    seen = set()
+    for e in elements:
+        e = [representative[i] for i in e if i != -1]
+        distinct = []
+        for i in e:
+            if i not in distinct:
+                distinct.append(i)
+        key = tuple(sorted(distinct))
+        if len(distinct) >= 3 and key not in seen:
+            seen.add(key)
+            new_elements.append(distinct)
+
+    interior = set(_interior_edge_keys(new_elements, n).tolist())
+    new_boundaries = []
+    seen = set()
+    for b in boundaries:
+        a, c = representative[b[0]], representative[b[1]]
+        key = min(a, c)*n + max(a, c)
+        if a == c or key in interior or key in seen:
+            continue
+        seen.add(key)
+        new_boundaries.append([a, c] + list(b[2:]))
+    new_curves = []
+    for c in curves:
+        a, b = representative[int(c[0])], representative[int(c[1])]
+        if a != b:
+            new_curves.append([a, b] + list(c[2:]))
+    return new_nodes, new_elements, new_boundaries, new_curves
+
+def concatenate_meshes(meshes):
+    """
+    Puts the meshes together (without merging anything).
+
+    Returns the tuple (nodes, elements, boundaries, curves) with the node
+    ids of every mesh shifted after the nodes of the previous meshes.
+    """
+    nodes = []
+    elements = []
+    boundaries = []
+    curves = []
+    for m in meshes:
+        offset = len(nodes)
+        nodes.extend([list(p) for p in m.nodes])
+        elements.extend([[i + offset for i in e if i != -1]
+            for e in m.elements])
+        boundaries.extend([[b[0] + offset, b[1] + offset] + list(b[2:])
+            for b in m.boundaries])
+        curves.extend([[int(c[0]) + offset, int(c[1]) + offset] + list(c[2:])
+            for c in m.curves])
+    return nodes, elements, boundaries, curves